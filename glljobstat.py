@@ -15,16 +15,37 @@ OSS/MDS via SSH using key or password, show top jobs and more ...
 import sys
 import time
 import signal
+import heapq
+import itertools
+import copy
+import threading
 import pickle
+import json
+import sqlite3
+import mmap
+import struct
+import bisect
+import lzma
+import gzip
+import uuid
+import zlib
+import shlex
+import socket
+import codecs
 import argparse
 import warnings
 import configparser
+from array import array
 from pathlib import Path
 from operator import add
 from getpass import getpass
-from os.path import expanduser
-from collections import Counter
-from multiprocessing import Pool, cpu_count
+from os.path import expanduser, exists, splitext
+from datetime import datetime
+from collections import Counter, OrderedDict
+from multiprocessing import Pool, TimeoutError as PoolTimeout, cpu_count
+from multiprocessing.pool import ThreadPool
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
 import urllib3
 import re
 
@@ -33,6 +54,16 @@ urllib3.disable_warnings()
 
 import paramiko # pylint: disable=wrong-import-position
 
+try:
+    import numpy as np # pylint: disable=wrong-import-position
+except ImportError:
+    np = None
+
+try:
+    import zstandard # pylint: disable=wrong-import-position
+except ImportError:
+    zstandard = None
+
 signal.signal(signal.SIGINT, signal.default_int_handler)
 
 class ArgParser: # pylint: disable=too-few-public-methods,too-many-instance-attributes
@@ -55,9 +86,10 @@ class ArgParser: # pylint: disable=too-few-public-methods,too-many-instance-attr
         self.totalratefile = None
 
 
-    def run(self): # pylint: disable=too-many-statements,too-many-branches
+    @staticmethod
+    def parser(): # pylint: disable=too-many-statements
         '''
-        define and parse arguments
+        define the arguments
         '''
         parser = argparse.ArgumentParser(prog='glljobstat.py',
                                          description='List top jobs.')
@@ -66,7 +98,8 @@ class ArgParser: # pylint: disable=too-few-public-methods,too-many-instance-attr
         parser.add_argument('-c', '--count', type=int, default=5,
                             help='the number of top jobs to be listed (default 5).')
         parser.add_argument('-i', '--interval', type=int, default=10,
-                            help='the interval in seconds to check job stats again (default 10).')
+                            help="""the interval in seconds to check job stats again, the queries
+                            start on multiples of it since the epoch (default 10).""")
         parser.add_argument('-n', '--repeats', type=int, default=-1,
                             help='the times to repeat the parsing (default unlimited).')
         parser.add_argument('--param', type=str, default='*.*.job_stats',
@@ -75,7 +108,9 @@ class ArgParser: # pylint: disable=too-few-public-methods,too-many-instance-attr
                             help="""sort by user / group / host / host_short / job / 
                             proc according to jobid_name Lustre pattern (default none).""")
         parser.add_argument('--sortby', type=str, default='ops',
-                            help="""sort top_jobs by operation type (ops, open, close, rename...)  (default ops).""")
+                            help="""sort top_jobs by operation type (ops, open, close, rename...)  (default ops).
+                            Comma separated keys with optional asc/desc are compared in order,
+                            e.g. "wr,rd" or "ops desc, job_id asc". Ties are sorted by job_id.""")
         parser.add_argument('-o', '--ost', dest='param', action='store_const',
                             const='obdfilter.*.job_stats',
                             help='check only OST job stats.')
@@ -90,7 +125,12 @@ class ArgParser: # pylint: disable=too-few-public-methods,too-many-instance-attr
                             action='store_false',
                             help='show abbreviated operations name.')
         parser.add_argument('-f', '--filter', dest='filter', type=str,
-                            help='Comma separated list of job_ids to ignore')
+                            help="""Comma separated list of job_ids to ignore. Entries
+                            match as substring, "=ID" exactly, "^ID" as prefix and
+                            "re:REGEX" as regular expression""")
+        parser.add_argument('-ff', '--filter_file', dest='filter_file', type=str,
+                            help="""File with more filter entries, one per line
+                            (overrides FILTER file of the config file)""")
         parser.add_argument('-fm', '--fmod', dest='fmod', action='store_true',
                             help="""Modify the filter to only show job_ids that
                             match the filter instead of removing them""")
@@ -104,17 +144,30 @@ class ArgParser: # pylint: disable=too-few-public-methods,too-many-instance-attr
         parser.add_argument('-minr', '--minrate', type=int, default=1,
                             help='the minimal ops rate number a job needs to be shown in top jobs (default 1).')
         parser.add_argument('-trf', '--totalratefile', dest='totalratefile', type=str,
-                            default=expanduser("~/.glljobstatdb.pickle"),
-                            help=f"""Path to a pickle file which will keep track of
-                            the higest rate (default {expanduser("~/.glljobstatdb.pickle")})""")
+                            help=f"""Path to the SQLite database which will keep track of
+                            the higest rates (default {TopRateDB.default_path}), an old
+                            pickle file given here is imported once""")
+        parser.add_argument('-trn', '--totalratenum', dest='totalratenum', type=int, default=10,
+                            help="""Number of highest rates kept per operation in the
+                            totalratefile, for the totals and for the jobs (default 10)""")
+        parser.add_argument('-trq', '--totalratequery', dest='totalratequery', type=str,
+                            help="""Print the highest rates kept in the totalratefile for
+                            these comma separated operations (or "all") and exit""")
+        parser.add_argument('-trs', '--since', dest='since', type=str,
+                            help="""Only print highest rates logged since this time with -trq,
+                            seconds since the epoch or 'YYYY-MM-DD[ HH:MM[:SS]]'""")
+        parser.add_argument('-tru', '--until', dest='until', type=str,
+                            help="""Only print highest rates logged until this time with -trq,
+                            seconds since the epoch or 'YYYY-MM-DD[ HH:MM[:SS]]'""")
         parser.add_argument('-p', '--percent', dest='percent', action='store_true',
                             help='Show top jobs in percentage to total ops')
         parser.add_argument('-ht', '--humantime', dest='humantime', action='store_true',
                             help='Show human readable time instead of timestamp')
         parser.add_argument('-nps', '--num_proc_ssh', dest="num_proc_ssh", type=int,
-                            default=cpu_count(),
-                            help=f"""Number of parallel SSH connections
-                            (default cpu count: {cpu_count()}).""")
+                            default=0,
+                            help="""Number of parallel SSH queries, they run in threads
+                            and are not limited by the cpu count
+                            (default 0: all queries at once).""")
         parser.add_argument('-npp', '--num_proc_data', dest="num_proc_data", type=int,
                             default=cpu_count(),
                             help=f"""Number of parallel data parsing tasks
@@ -122,16 +175,103 @@ class ArgParser: # pylint: disable=too-few-public-methods,too-many-instance-attr
         parser.add_argument('-ncs', '--num_chunk_ssh', dest="num_chunk_ssh", type=int,
                             default=1,
                             help="""Chops the number of parallel SSH jobs into a number of chunks
-                            which it submits to the process pool as separate tasks (default: 1)""")
+                            which it submits to the thread pool as separate tasks (default: 1)""")
         parser.add_argument('-ncp', '--num_chunk_data', dest="num_chunk_data", type=int,
                             default=1,
-                            help="""Chops the number of parallel data pasing tasks into a number
-                            of chunks which it submits to the process pool as separate tasks
-                            (default: 1)""")
+                            help="""Minimal number of targets of a server a data parsing task
+                            parses and merges before it hands them back, the targets are spread
+                            over --num_proc_data tasks otherwise (default: 1)""")
+        parser.add_argument('-b', '--batch', dest='batch', action='store_true',
+                            help="""Fetch the job_stats of all targets of a server with a
+                            single remote command instead of one command per target""")
+        parser.add_argument('-st', '--stream', dest='stream', action='store_true',
+                            help="""Parse job_stats while the SSH output is still arriving
+                            instead of handing the full output to the parser processes""")
+        parser.add_argument('-a', '--agent', dest='agent', action='store_true',
+                            help="""Run a small Python helper on each OSS/MDS which reads job_stats
+                            locally and only sends the samples of each job back""")
+        parser.add_argument('-ad', '--agent_delta', dest='agent_delta', action='store_true',
+                            help="""Like --agent, but the helper keeps the previous snapshot on
+                            the OSS/MDS (tmpfs) and only sends jobs which changed since the
+                            last query""")
+        parser.add_argument('-z', '--compress', dest='compress', type=str, default='none',
+                            choices=['none', 'auto', 'gzip', 'zstd', 'xz'],
+                            help="""Compress job_stats on the OSS/MDS before the transfer, auto
+                            picks the first of zstd, gzip and xz available on both sides.
+                            Use -v to see the bytes per host before and after compression
+                            (default none).""")
+        parser.add_argument('-e', '--engine', dest='engine', type=str, default='auto',
+                            choices=['auto', 'dict', 'numpy'],
+                            help="""Aggregation engine, numpy keeps all jobs in a job x operation
+                            array, auto uses it when numpy is installed and --hist is not
+                            used (default auto).""")
+        parser.add_argument('-tl', '--tick_limit', dest='tick_limit', type=float, default=0,
+                            help="""Finish a query with the servers which answered within this
+                            many seconds, the others are missing, 0 waits for all of them
+                            (default 0)""")
+        parser.add_argument('-cto', '--connect_timeout', dest='connect_timeout', type=float,
+                            default=10,
+                            help="""Seconds to wait for the SSH connection to a server,
+                            0 waits forever (default 10)""")
+        parser.add_argument('-rto', '--read_timeout', dest='read_timeout', type=float,
+                            default=30,
+                            help="""Seconds to wait for more output of a server, 0 waits
+                            forever (default 30)""")
+        parser.add_argument('-km', '--keep_missing', dest='keep_missing', type=int, default=3,
+                            help="""Reuse the last job_stats of a server which did not answer
+                            for up to this many queries in a row, so its jobs do not drop out
+                            of the rates (default 3)""")
+        parser.add_argument('-mis', '--max_idle_ssh', dest="max_idle_ssh", type=int,
+                            default=256,
+                            help="""Maximum number of idle SSH connections kept open
+                            between two queries (default: 256)""")
+        parser.add_argument('-ipb', '--inline_parse_bytes', dest="inline_parse_bytes", type=int,
+                            default=524288,
+                            help="""Parse in the main process instead of the parser processes
+                            when less than this many bytes were received or only a single
+                            target was queried (default: 524288)""")
         parser.add_argument('-hi', '--hist', dest='enablehist', action='store_true',
                             help="""Explicetly enable read_bytes & write_bytes histogram as long
                             as it is not fully implemented into glljobstat.
                             This might make glljobstat.py fail when used with other flgs!""")
+        parser.add_argument('-hf', '--historyfile', dest='historyfile', type=str,
+                            help="""Keep the rates of all jobs of every query in this ring
+                            buffer file, see "glljobstat.py query -h" (implies -r)""")
+        parser.add_argument('-hs', '--historysize', dest='historysize', type=int,
+                            default=1 << 20,
+                            help="""Number of job rate records the historyfile keeps when it
+                            is created, the oldest ones are overwritten (default 1048576)""")
+        parser.add_argument('-rec', '--record', dest='record', type=str, metavar='DIR',
+                            help="""Save the raw job_stats of every query compressed in DIR,
+                            to be replayed with --replay (not with -st or -a)""")
+        parser.add_argument('-rep', '--replay', dest='replay', type=str, metavar='DIR',
+                            help="""Replay the job_stats recorded with --record in DIR instead
+                            of querying the servers, no config file or SSH is needed""")
+        parser.add_argument('-lc', '--local', dest='local', type=str, nargs='?', const='/',
+                            metavar='ROOT',
+                            help="""Read the job_stats of this OSS/MDS straight from
+                            /proc/fs/lustre and /sys/fs/lustre below ROOT (default /) instead
+                            of querying the servers over SSH, no config file is needed""")
+        parser.add_argument('-rps', '--replay_speed', dest='replay_speed', type=float,
+                            default=0,
+                            help="""Replay at this multiple of the recorded speed,
+                            0 replays as fast as possible (default 0)""")
+        parser.add_argument('-mt', '--metrics', dest='metrics', type=str, metavar='FILE',
+                            help="""Write the duration of every stage, the SSH connect and
+                            command times and bytes per host and the parse time and jobs
+                            per target of each query to FILE""")
+        parser.add_argument('-mtf', '--metrics_format', dest='metrics_format', type=str,
+                            default='jsonl', choices=['jsonl', 'prom'],
+                            help="""jsonl appends one JSON line per query, prom replaces FILE
+                            with the last query in the Prometheus text format (default jsonl)""")
+        parser.add_argument('-srv', '--serve', dest='serve', type=str, metavar='[HOST:]PORT',
+                            help="""Run as daemon and serve the rates of the last query over
+                            HTTP instead of printing them, /metrics in the Prometheus text
+                            format and /top?count=N&sortby=KEYS as JSON (implies -r, HOST is
+                            127.0.0.1 by default)""")
+        parser.add_argument('-srj', '--serve_jobs', dest='serve_jobs', type=int, default=100,
+                            help="""Number of top jobs with a job_id label in /metrics, limits
+                            the number of series (default 100)""")
         parser.add_argument('-v', '--verbose', dest='verb', action='store_true',
                             help='Show some debug and timing information')
 
@@ -142,22 +282,63 @@ class ArgParser: # pylint: disable=too-few-public-methods,too-many-instance-attr
         group_ex.add_argument('-r', '--rate', dest='rate', action='store_true',
                             help='Calculate the rate between two queries')
 
-        self.args = parser.parse_args()
+        subparsers = parser.add_subparsers(dest='command', metavar='{query}')
+        query = subparsers.add_parser('query', help="""top jobs, totals or all records in a
+                                      time range of a historyfile, see query -h""")
+        query.add_argument('historyfile', metavar='HISTORYFILE',
+                           help='historyfile written with -hf')
+        query.add_argument('-qm', '--query_mode', dest='query_mode', default='top',
+                           choices=['top', 'sum', 'scan'],
+                           help="""top: jobs with the most operations, sum: operations of all
+                           jobs, scan: every record (default top)""")
+        query.add_argument('-qo', '--query_op', dest='query_op', default='ops',
+                           help='operation the top jobs are sorted by (default ops)')
+        query.add_argument('-c', '--count', type=int, default=5,
+                           help='the number of top jobs to be listed (default 5).')
+        query.add_argument('-f', '--filter', dest='filter', type=str,
+                           help="""Comma separated list of job_ids to include,
+                           same entries as for the filter of top jobs""")
+        query.add_argument('-trs', '--since', dest='since', type=str,
+                           help="""Only records logged since this time, seconds since the
+                           epoch or 'YYYY-MM-DD[ HH:MM[:SS]]'""")
+        query.add_argument('-tru', '--until', dest='until', type=str,
+                           help="""Only records logged until this time, seconds since the
+                           epoch or 'YYYY-MM-DD[ HH:MM[:SS]]'""")
+        query.add_argument('--fullname', dest='fullname', action='store_true',
+                           help='show full operation name')
+        query.add_argument('-ht', '--humantime', dest='humantime', action='store_true',
+                           help='Show human readable time instead of timestamp')
+
+        return parser
+
+    def run(self): # pylint: disable=too-many-statements,too-many-branches
+        '''
+        parse arguments
+        '''
+        self.args = self.parser().parse_args()
+        if self.args.command == 'query':
+            self.filter = JobFilter(self.args.filter.split(",") if self.args.filter else [])
+            self.jobid_length = 17
+            return
         self.config = configparser.ConfigParser()
 
         
         self.configfile = expanduser(self.args.configfile)
         
-        if not Path(self.configfile).is_file():
+        if not Path(self.configfile).is_file() and (self.args.replay or self.args.local):
+            self.config.read_dict({'SERVERS': {'list': ''}, 'FILTER': {'list': ''}, 'MISC': {},
+                                   'SSH': {'user': '', 'key': '', 'keytype': ''}})
+        elif not Path(self.configfile).is_file():
             self.config['SERVERS'] = {
                 '#list': "Comma separated list of OSS/MDS to query",
             }
             self.config['FILTER'] = {
                 '#list': "Comma separated list of job_ids to ignore",
+                '#file': "File with more job_ids to ignore, one per line",
             }
             self.config['MISC'] = {
                 '#jobid_length': 17,
-                '#totalratefile': expanduser("~/.glljobstat.db")
+                '#totalratefile': TopRateDB.default_path
             }
             self.config['SSH'] = {
                 '#user': "SSH user to connect to OSS/MDS",
@@ -178,14 +359,19 @@ class ArgParser: # pylint: disable=too-few-public-methods,too-many-instance-attr
             self.servers = {i.strip() for i in self.config['SERVERS']['LIST'].split(",") if i != ''}
 
         if self.args.filter:
-            self.filter = set(self.args.filter.split(","))
+            filter_entries = self.args.filter.split(",")
         else:
-            self.filter = {i.strip() for i in self.config['FILTER']['LIST'].split(",") if i != ''}
+            filter_entries = [i.strip() for i in self.config['FILTER']['LIST'].split(",") if i != '']
+        filter_file = self.args.filter_file or self.config['FILTER'].get('file')
+        if filter_file:
+            filter_entries += JobFilter.read_file(filter_file)
+        self.filter = JobFilter(filter_entries)
 
         if self.args.totalratefile:
             self.totalratefile = self.args.totalratefile
         else:
-            self.totalratefile = self.config['MISC']['totalratefile']
+            self.totalratefile = expanduser(self.config['MISC'].get('totalratefile',
+                                                                    TopRateDB.default_path))
 
         if self.args.jobid_length:
             self.jobid_length = int(self.args.jobid_length)
@@ -201,9 +387,21 @@ class ArgParser: # pylint: disable=too-few-public-methods,too-many-instance-attr
 
         if self.config['SSH']['key']:
             self.key = self.config['SSH']['key']
-        else:
+        elif not (self.args.totalratequery or self.args.replay or self.args.local):
             self.password = getpass()
 
+        if self.args.historyfile:
+            if np is None or self.args.difference:
+                print('--historyfile needs the python numpy module and can not be used with --dif')
+                sys.exit()
+            self.args.rate = True
+
+        if self.args.serve:
+            if self.args.difference:
+                print('--serve serves rates and can not be used with --dif')
+                sys.exit()
+            self.args.rate = True
+
         if self.args.totalrate:
             self.args.rate = True
             self.args.total = True
@@ -217,6 +415,1763 @@ class ArgParser: # pylint: disable=too-few-public-methods,too-many-instance-attr
         if self.args.percent:
             self.args.total = True
 
+        if self.args.compress == 'zstd' and zstandard is None:
+            print('--compress zstd needs the python zstandard module')
+            sys.exit()
+
+        if self.args.agent_delta:
+            self.args.agent = True
+
+        if self.args.engine == 'numpy' and (np is None or self.args.enablehist):
+            print('--engine numpy needs the python numpy module and can not be used with --hist')
+            sys.exit()
+        if self.args.engine == 'auto':
+            self.args.engine = 'numpy' if np is not None and not self.args.enablehist else 'dict'
+
+        if self.args.record and (self.args.stream or self.args.agent or self.args.replay):
+            print('--record saves the raw job_stats and can not be used with --stream, '
+                  '--agent or --replay')
+            sys.exit()
+
+        if self.args.local and (self.args.stream or self.args.agent or self.args.replay):
+            print('--local reads the job_stats files and can not be used with --stream, '
+                  '--agent or --replay')
+            sys.exit()
+
+        if self.args.agent and self.args.enablehist:
+            print('--agent does not transfer histograms and can not be used with --hist')
+            sys.exit()
+
+
+class JobFilter:
+    '''
+    Class to match job_ids against all filter entries at once. Entries
+    match as substring, "=ID" exactly, "^ID" as prefix and "re:REGEX" as
+    regular expression. Exact entries are a set lookup, prefix and
+    substring entries are compiled into trie shaped regexes, so the cost
+    per job_id hardly grows with the number of entries. Regular expressions
+    are compiled one by one, they may have global flags like (?i).
+    '''
+    cache_size = 1 << 16
+
+    def __init__(self, entries):
+        exact, prefixes, substrings, regexes = set(), set(), set(), []
+        for entry in entries:
+            entry = entry.strip()
+            if entry.startswith('='):
+                exact.add(entry[1:])
+            elif entry.startswith('^'):
+                prefixes.add(entry[1:])
+            elif entry.startswith('re:'):
+                regexes.append(entry[3:])
+            elif entry:
+                substrings.add(entry)
+
+        self.entries = len(exact) + len(prefixes) + len(substrings) + len(regexes)
+        self.exact = exact
+        self.regexes = []
+        for regex in regexes:
+            try:
+                self.regexes.append(re.compile(regex))
+            except re.error as exn:
+                print(f"Invalid regular expression in filter entry 're:{regex}': {exn}")
+                sys.exit()
+        self.prefix = re.compile(self.trie_regex(prefixes)) if prefixes else None
+        self.pattern = re.compile(self.trie_regex(substrings)) if substrings else None
+        self.cache = {}
+
+    def __len__(self):
+        return self.entries
+
+    @classmethod
+    def trie_regex(cls, words):
+        '''
+        regex matching any of words, sharing common prefixes like a trie
+        '''
+        trie = {}
+        for word in words:
+            node = trie
+            for char in word:
+                node = node.setdefault(char, {})
+            node[''] = {}
+        return cls.trie_node_regex(trie)
+
+    @classmethod
+    def trie_node_regex(cls, node):
+        '''
+        regex of a trie node, a word ending here already is a match
+        '''
+        if '' in node:
+            return ''
+        alternatives, chars = [], []
+        for char in sorted(node):
+            rest = cls.trie_node_regex(node[char])
+            if rest:
+                alternatives.append(re.escape(char) + rest)
+            else:
+                chars.append(re.escape(char))
+        if len(chars) == 1:
+            alternatives.append(chars[0])
+        elif chars:
+            alternatives.append('[' + ''.join(chars) + ']')
+        if len(alternatives) == 1:
+            return alternatives[0]
+        return '(?:' + '|'.join(alternatives) + ')'
+
+    @staticmethod
+    def read_file(path):
+        '''
+        read filter entries from a file, one per line or comma separated,
+        lines starting with # are ignored
+        '''
+        entries = []
+        try:
+            with open(expanduser(path), 'r', encoding='utf-8') as filterf:
+                for line in filterf:
+                    if not line.strip().startswith('#'):
+                        entries += line.split(',')
+        except OSError as exn:
+            print(f'Can not read filter file {path}: {exn}')
+            sys.exit()
+        return entries
+
+    def match(self, job_id):
+        '''
+        True if job_id matches any entry, results are cached as the same
+        job_ids come back with every query. Exact and prefix entries are
+        matched without the quotes --groupby puts around the job_id.
+        '''
+        matched = self.cache.get(job_id)
+        if matched is None:
+            bare = job_id[1:-1] if len(job_id) > 1 and job_id[0] == job_id[-1] == '"' else job_id
+            matched = (bare in self.exact or
+                       bool(self.prefix and self.prefix.match(bare)) or
+                       bool(self.pattern and self.pattern.search(job_id)) or
+                       any(regex.search(job_id) for regex in self.regexes))
+            if len(self.cache) >= self.cache_size:
+                self.cache.clear()
+            self.cache[job_id] = matched
+        return matched
+
+
+class SSHConnectionPool:
+    '''
+    Class to keep one authenticated SSH transport per OSS/MDS open across
+    queries and multiplex new channels over it
+    '''
+    key_classes = {
+        'DSS'    : 'DSSKey',
+        'DSA'    : 'DSSKey',
+        'ECDSA'  : 'ECDSAKey',
+        'RSA'    : 'RSAKey',
+        'Ed25519': 'Ed25519Key',
+    }
+
+    keepalive = 30
+
+    def __init__(self, argparser, max_idle):
+        self.argparser = argparser
+        self.max_idle = max_idle
+        self.pkey = None
+        self.clients = {}
+        self.last_used = {}
+        self.busy = Counter()
+        self.host_locks = {}
+        self.connect_times = Counter()
+        self.lock = threading.Lock()
+
+        if not self.argparser.password:
+            self.pkey = self.load_key()
+
+    def __getstate__(self):
+        '''
+        Keys, live connections and locks are never shared with worker processes
+        '''
+        state = self.__dict__.copy()
+        state.update({'pkey': None, 'clients': {}, 'last_used': {}, 'busy': Counter(),
+                      'host_locks': {}, 'connect_times': Counter(), 'lock': None})
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def load_key(self):
+        '''
+        Read the private key file once for all connections
+        '''
+        key_class = getattr(paramiko, self.key_classes.get(self.argparser.keytype, ''), None)
+        if key_class is None:
+            print(f'Unsupported SSH keytype {self.argparser.keytype}, terminating')
+            sys.exit()
+        return key_class.from_private_key_file(filename=self.argparser.key)
+
+    def connect(self, host):
+        '''
+        Open and authenticate a new SSH connection to host
+        '''
+        ssh = paramiko.SSHClient()
+        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+
+        timeout = self.argparser.args.connect_timeout or None
+        try:
+            if self.argparser.password:
+                ssh.connect(hostname=host,
+                            username=self.argparser.user,
+                            password=self.argparser.password,
+                            timeout=timeout, banner_timeout=timeout, auth_timeout=timeout)
+            else:
+                ssh.connect(hostname=host,
+                            username=self.argparser.user,
+                            pkey=self.pkey,
+                            timeout=timeout, banner_timeout=timeout, auth_timeout=timeout)
+        except paramiko.ssh_exception.NoValidConnectionsError as exn:
+            print(f'Exception in ssh.connect(hostname={host})\n', exn)
+            raise
+
+        ssh.get_transport().set_keepalive(self.keepalive)
+        return ssh
+
+    def get_transport(self, host):
+        '''
+        Return an active transport to host, reconnect if it was dropped
+        '''
+        with self.lock:
+            host_lock = self.host_locks.setdefault(host, threading.Lock())
+
+        with host_lock:
+            ssh = self.clients.get(host)
+            transport = ssh.get_transport() if ssh else None
+            if transport is None or not transport.is_active():
+                if ssh:
+                    ssh.close()
+                start = time.perf_counter()
+                ssh = self.connect(host)
+                transport = ssh.get_transport()
+                self.clients[host] = ssh
+                with self.lock:
+                    self.connect_times[host] += time.perf_counter() - start
+
+        with self.lock:
+            self.busy[host] += 1
+            self.last_used[host] = time.time()
+
+        return transport
+
+    def pop_connect_times(self):
+        '''
+        Return and reset the seconds spent connecting per host
+        '''
+        with self.lock:
+            connect_times, self.connect_times = self.connect_times, Counter()
+        return connect_times
+
+    def release(self, host):
+        '''
+        Mark one channel to host as finished
+        '''
+        with self.lock:
+            self.busy[host] -= 1
+            self.last_used[host] = time.time()
+
+    def drop(self, host):
+        '''
+        Close and forget the connection to host
+        '''
+        with self.lock:
+            ssh = self.clients.pop(host, None)
+            self.last_used.pop(host, None)
+        if ssh:
+            ssh.close()
+
+    def exec_stream(self, host, cmd, bufsize=65536):
+        '''
+        Run cmd on host over a new channel and yield its stdout in chunks
+        as they arrive
+        '''
+        for retry in (True, False):
+            transport = self.get_transport(host)
+            try:
+                chan = transport.open_session(timeout=self.argparser.args.connect_timeout or None)
+            except (paramiko.SSHException, EOFError, OSError):
+                self.release(host)
+                self.drop(host)
+                if not retry:
+                    raise
+                continue
+            break
+
+        try:
+            # recv raises socket.timeout when the host stops sending
+            chan.settimeout(self.argparser.args.read_timeout or None)
+            chan.exec_command(cmd)
+            for chunk in iter(lambda: chan.recv(bufsize), b''):
+                yield chunk
+        finally:
+            chan.close()
+            self.release(host)
+
+    def exec_command(self, host, cmd):
+        '''
+        Run cmd on host over a new channel and return its stdout as bytes
+        '''
+        return b''.join(self.exec_stream(host, cmd))
+
+    def prune(self):
+        '''
+        Close the least recently used idle connections above max_idle
+        '''
+        with self.lock:
+            idle = sorted((ts, host) for host, ts in self.last_used.items()
+                          if not self.busy[host])
+        for _, host in idle[:max(len(self.clients) - self.max_idle, 0)]:
+            self.drop(host)
+
+    def close(self):
+        '''
+        Close all connections
+        '''
+        for host in list(self.clients):
+            self.drop(host)
+
+
+class CollectionEngine:
+    '''
+    Class to run the I/O bound SSH queries concurrently in threads of the
+    main process. The concurrency only depends on --num_proc_ssh, nothing is
+    forked or pickled.
+    '''
+    def __init__(self, num_threads, chunksize=1):
+        self.num_threads = num_threads
+        self.chunksize = chunksize
+        self.thread_pool = None
+        self.size = 0
+
+    def run(self, func, tasks, deadline=None):
+        '''
+        call func for every task and yield the results as they complete,
+        the thread pool is kept for the next call. Results not there by the
+        deadline (time.time()) are not waited for.
+        '''
+        if not tasks:
+            return
+        size = self.num_threads or len(tasks)
+        if self.thread_pool is None or size > self.size:
+            self.close()
+            self.thread_pool = ThreadPool(processes=size)
+            self.size = size
+        results = self.thread_pool.imap_unordered(func=func,
+                                                  iterable=tasks,
+                                                  chunksize=self.chunksize)
+        if deadline is None:
+            yield from results
+            return
+        for _ in tasks:
+            try:
+                yield results.next(max(deadline - time.time(), 0))
+            except PoolTimeout:
+                # threads still waiting for a server can not be stopped, the
+                # pool is left to finish them and a new one is started
+                self.thread_pool.close()
+                self.thread_pool = None
+                self.size = 0
+                return
+
+    def close(self):
+        '''
+        stop all threads
+        '''
+        if self.thread_pool is not None:
+            self.thread_pool.terminate()
+            self.thread_pool = None
+            self.size = 0
+
+
+class JobStatsStreamParser:
+    '''
+    Class to parse job_stats incrementally while the output is still arriving.
+    Every chunk is split after the last complete job block which is parsed
+    right away, only the incomplete rest is kept until the next chunk.
+    Targets of a batch start at a marker line, which is preceded by a
+    newline of its own.
+    '''
+    def __init__(self, parse, marker=None):
+        self.parse = parse
+        self.marker = '\n' + marker if marker else None
+        self.pending = ''
+        self.decoder = codecs.getincrementaldecoder('UTF-8')()
+        self.targets = [] if marker else [{"job_stats": []}]
+
+    def emit(self, text):
+        '''
+        parse complete job blocks into the current target
+        '''
+        if text and self.targets:
+            self.targets[-1]["job_stats"].extend(self.parse(text)["job_stats"])
+
+    def feed(self, chunk, final=False):
+        '''
+        add a chunk of raw output
+        '''
+        self.pending += self.decoder.decode(chunk, final)
+
+        while self.marker:
+            pos = self.pending.find(self.marker)
+            eol = self.pending.find('\n', pos + 1)
+            if pos < 0 or eol < 0:
+                break
+            self.emit(self.pending[:pos])
+            self.targets.append({"job_stats": []})
+            self.pending = self.pending[eol + 1:]
+
+        cut = self.pending.rfind('\n- job_id:')
+        if cut > 0:
+            self.emit(self.pending[:cut + 1])
+            self.pending = self.pending[cut + 1:]
+
+    def close(self):
+        '''
+        parse the remaining output and return the parsed job_stats per target
+        '''
+        self.feed(b'', final=True)
+        self.emit(self.pending)
+        self.pending = ''
+        return self.targets
+
+
+class CompactJobStats:
+    '''
+    Class to hold the parsed job_stats of one target in a compact form which
+    is cheap to pickle: the job ids, the snapshot/start/elapsed times as one
+    int array (-1 if missing) and the samples of ops (in the order they show
+    up in job_stats) as one int array of len(job_ids) x len(ops).
+    Once grouped it is a partial aggregate of one or more targets, hidden
+    holds the job ids the filter removes from the top jobs.
+    '''
+    __slots__ = ('ops', 'job_ids', 'times', 'samples', 'hidden')
+
+    time_keys = ('snapshot_time', 'start_time', 'elapsed_time')
+
+    # job_id line, "key: { samples: N, ..." metric line or "key: N[.nsecs]" line
+    pattern = re.compile(rb'^(?:- job_id:[ \t]+(\S+)|[ \t]+(\w+):[ \t]+'
+                         rb'(?:\{[ \t]*samples:[ \t]*(\d+)|(\d+)))', re.M)
+
+    def __init__(self, ops, job_ids, times, samples, hidden=None): # pylint: disable=too-many-arguments
+        self.ops = ops
+        self.job_ids = job_ids
+        self.times = times
+        self.samples = samples
+        self.hidden = hidden if hidden is not None else set()
+
+    @classmethod
+    def from_job_stats(cls, job_stats, include):
+        '''
+        pack parsed job_stats, only the samples of the ops in include are kept
+        '''
+        col_index = {}
+        for job in job_stats:
+            for key in job:
+                if key in include and key not in col_index:
+                    col_index[key] = len(col_index)
+
+        width = len(col_index)
+        times = array('q', [-1]) * (3 * len(job_stats))
+        samples = array('q', [0]) * (width * len(job_stats))
+        for i, job in enumerate(job_stats):
+            for j, key in enumerate(cls.time_keys):
+                if key in job:
+                    times[3 * i + j] = job[key]
+            for key, col in col_index.items():
+                if key in job:
+                    samples[width * i + col] = job[key]['samples']
+
+        return cls(list(col_index), [job['job_id'] for job in job_stats], times, samples)
+
+    def __len__(self):
+        return len(self.job_ids)
+
+    @classmethod
+    def from_bytes(cls, data, include): # pylint: disable=too-many-locals
+        '''
+        fast path parsing raw job_stats bytes straight into the compact form,
+        only job ids, timestamps and samples are extracted
+        '''
+        include = {key.encode() for key in include}
+        time_cols = {key.encode(): col for col, key in enumerate(cls.time_keys)}
+        col_index = {}
+        job_ids = []
+        times = array('q')
+        entry_jobs, entry_cols, entry_samples = [], [], []
+        job = -1
+        has_metrics = True
+
+        for job_id, key, samples, stamp in cls.pattern.findall(data):
+            if job_id:
+                if not has_metrics:
+                    # like parse_single_job_stats_beo, drop jobs without metrics
+                    job_ids.pop()
+                    del times[-3:]
+                    job -= 1
+                job_ids.append(job_id.decode('UTF-8'))
+                times.extend((-1, -1, -1))
+                job += 1
+                has_metrics = False
+            elif job < 0:
+                continue
+            elif samples:
+                has_metrics = True
+                if key in include:
+                    col = col_index.setdefault(key, len(col_index))
+                    if samples != b'0':
+                        entry_jobs.append(job)
+                        entry_cols.append(col)
+                        entry_samples.append(int(samples))
+            elif key in time_cols:
+                times[3 * job + time_cols[key]] = int(stamp)
+
+        if not has_metrics:
+            job_ids.pop()
+            del times[-3:]
+
+        width = len(col_index)
+        packed = array('q', [0]) * (width * len(job_ids))
+        for entry_job, entry_col, entry_sample in zip(entry_jobs, entry_cols, entry_samples):
+            packed[width * entry_job + entry_col] = entry_sample
+
+        return cls([key.decode() for key in col_index], job_ids, times, packed)
+
+    def jobs(self):
+        '''
+        yield the jobs as parsed job dicts
+        '''
+        width = len(self.ops)
+        for i, job_id in enumerate(self.job_ids):
+            job = {'job_id': job_id}
+            for j, key in enumerate(self.time_keys):
+                if self.times[3 * i + j] != -1:
+                    job[key] = self.times[3 * i + j]
+            for col, key in enumerate(self.ops):
+                job[key] = {'samples': self.samples[width * i + col]}
+            yield job
+
+    def empty(self, ops, job_ids, hidden):
+        '''
+        object of the same kind for ops and job_ids without any samples
+        '''
+        return CompactJobStats(ops, job_ids, array('q', [-1]) * (3 * len(job_ids)),
+                               array(self.samples.typecode, [0]) * (len(ops) * len(job_ids)),
+                               hidden)
+
+    def add_row(self, row, src, i, cols, fresh): # pylint: disable=too-many-arguments
+        '''
+        add job i of src to row, cols are the columns of the ops of src.
+        fresh means row is still empty and the ops of src are the first ones
+        of self in the same order, the values are then just copied.
+        '''
+        width, src_width = len(self.ops), len(src.ops)
+        src_samples = src.samples[src_width * i:src_width * (i + 1)]
+        if fresh:
+            self.samples[width * row:width * row + src_width] = src_samples
+            self.times[3 * row:3 * row + 3] = src.times[3 * i:3 * i + 3]
+            return
+        for j in range(3):
+            self.times[3 * row + j] = max(self.times[3 * row + j], src.times[3 * i + j])
+        for col, value in zip(cols, src_samples):
+            if value:
+                self.samples[width * row + col] += value
+
+    def grouped(self, group_jobid, keep_job):
+        '''
+        sum up the jobs sharing a group job_id and mark the hidden ones
+        '''
+        index = {}
+        rows = [index.setdefault(group_jobid(job_id), len(index)) for job_id in self.job_ids]
+        job_ids = list(index)
+        hidden = {job_id for job_id in job_ids if not keep_job(job_id)}
+        if len(job_ids) == len(self.job_ids):
+            grouped = copy.copy(self)
+            grouped.job_ids, grouped.hidden = job_ids, hidden
+            return grouped
+
+        grouped = self.empty(self.ops, job_ids, hidden)
+        cols = list(range(len(self.ops)))
+        seen = set()
+        for i, row in enumerate(rows):
+            grouped.add_row(row, self, i, cols, row not in seen)
+            seen.add(row)
+        return grouped
+
+    def merge(self, other):
+        '''
+        merge two grouped objects into a new one, samples are summed and
+        the latest times are kept. Jobs and ops of self come first.
+        '''
+        ops = self.ops + [op for op in other.ops if op not in self.ops]
+        index = {job_id: row for row, job_id in enumerate(self.job_ids)}
+        job_ids = list(self.job_ids)
+        for job_id in other.job_ids:
+            if job_id not in index:
+                index[job_id] = len(job_ids)
+                job_ids.append(job_id)
+
+        merged = self.empty(ops, job_ids, self.hidden | other.hidden)
+        self_cols = list(range(len(self.ops)))
+        other_cols = [ops.index(op) for op in other.ops]
+        other_fresh = other_cols == list(range(len(other.ops)))
+        for i in range(len(self.job_ids)):
+            merged.add_row(i, self, i, self_cols, True)
+        for i, job_id in enumerate(other.job_ids):
+            row = index[job_id]
+            merged.add_row(row, other, i, other_cols, other_fresh and row >= len(self.job_ids))
+        return merged
+
+
+class CompactJobRates(CompactJobStats):
+    '''
+    Class to hold the rates (or differences) of jobs between two queries,
+    computed per target and job with the snapshot_time of each target.
+    samples are floats, present marks the ops with non zero counters and
+    windows holds the sampling window of every job (0 if it has no rate).
+    '''
+    __slots__ = ('present', 'windows')
+
+    def __init__(self, ops, job_ids, times, samples, present, windows, hidden=None): # pylint: disable=too-many-arguments
+        super().__init__(ops, job_ids, times, samples, hidden)
+        self.present = present
+        self.windows = windows
+
+    @classmethod
+    def from_counters(cls, new, ref, rate): # pylint: disable=too-many-locals
+        '''
+        rates of the jobs of one target from its current and previous
+        counters. A counter going backwards or a changed start_time is a
+        reset, the counter is then taken as increase since the reset. Jobs
+        started since the previous query count from zero.
+        '''
+        width, ref_width = len(new.ops), len(ref.ops)
+        ref_rows = {job_id: row for row, job_id in enumerate(ref.job_ids)}
+        ref_cols = [ref.ops.index(op) if op in ref.ops else -1 for op in new.ops]
+        last_query = max(ref.times[0::3], default=-1)
+        rates = cls(new.ops, new.job_ids, new.times,
+                    array('d', [0]) * (width * len(new.job_ids)),
+                    array('b', [0]) * (width * len(new.job_ids)),
+                    array('q', [0]) * len(new.job_ids))
+
+        for i, job_id in enumerate(new.job_ids):
+            counters = new.samples[width * i:width * (i + 1)]
+            snapshot, start = new.times[3 * i], new.times[3 * i + 1]
+            row = ref_rows.get(job_id)
+            if row is not None:
+                ref_snapshot, ref_start = ref.times[3 * row], ref.times[3 * row + 1]
+                old = ref.samples[ref_width * row:ref_width * (row + 1)]
+                old = [old[col] if col >= 0 else 0 for col in ref_cols]
+                reset = start != ref_start and -1 not in (start, ref_start)
+            elif -1 < last_query <= start:
+                ref_snapshot, old, reset = last_query, [0] * width, False
+            else:
+                continue
+            window = snapshot - ref_snapshot
+            if snapshot < 0 or ref_snapshot < 0 or window <= 0:
+                continue
+
+            rates.windows[i] = window
+            for col, (value, old_value) in enumerate(zip(counters, old)):
+                if not value:
+                    continue
+                rates.present[width * i + col] = 1
+                dif = value if reset or value < old_value else value - old_value
+                rates.samples[width * i + col] = dif / window if rate else dif
+        return rates
+
+    def empty(self, ops, job_ids, hidden):
+        return CompactJobRates(ops, job_ids, array('q', [-1]) * (3 * len(job_ids)),
+                               array('d', [0]) * (len(ops) * len(job_ids)),
+                               array('b', [0]) * (len(ops) * len(job_ids)),
+                               array('q', [0]) * len(job_ids), hidden)
+
+    def add_row(self, row, src, i, cols, fresh): # pylint: disable=too-many-arguments
+        super().add_row(row, src, i, cols, fresh)
+        width, src_width = len(self.ops), len(src.ops)
+        src_present = src.present[src_width * i:src_width * (i + 1)]
+        if fresh:
+            self.present[width * row:width * row + src_width] = src_present
+        else:
+            for col, present in zip(cols, src_present):
+                if present:
+                    self.present[width * row + col] = 1
+        self.windows[row] = max(self.windows[row], src.windows[i])
+
+
+class JobIdTable:
+    '''
+    Class to intern job_ids across queries, the job_ids unpickled from the
+    parser processes are replaced by the copy already kept, so every
+    job_id string is kept once instead of once per query
+    '''
+    max_size = 1 << 22
+
+    def __init__(self):
+        self.job_ids = {}
+
+    def __len__(self):
+        return len(self.job_ids)
+
+    def intern(self, job_ids):
+        '''
+        the kept copies of job_ids, unknown job_ids are kept from now on
+        '''
+        return [self.job_ids.setdefault(job_id, job_id) for job_id in job_ids]
+
+
+class JobMatrix:
+    '''
+    Class to hold the counters of all jobs in a dense job x operation array.
+    present marks which operations a job dict of the dict engine would have,
+    rank keeps the order in which they would have been inserted, so totals,
+    ties and printed jobs come out exactly like with the dict engine.
+    '''
+    def __init__(self, ops, job_ids, values, present, rank, windows=None): # pylint: disable=too-many-arguments
+        self.ops = ops
+        self.job_ids = job_ids
+        self.values = values
+        self.present = present
+        self.rank = rank
+        self.windows = windows
+
+    @classmethod
+    def from_job_stats(cls, ops, partials, table=None): # pylint: disable=too-many-locals
+        '''
+        build the matrix from grouped CompactJobStats or CompactJobRates,
+        jobs found in more than one of them are summed up. The job_ids are
+        interned in table if one is given.
+        '''
+        col_index = {op: col for col, op in enumerate(ops) if op != 'ops'}
+        index = {}
+        packed = [[], [], []]
+        packed_totals = [[], []]
+        packed_windows = [[], []]
+
+        for partial in partials:
+            rows = np.array([index.setdefault(job_id, len(index)) for
+                             job_id in partial.job_ids], dtype=np.int64)
+            shape = (len(partial), len(partial.ops))
+            if isinstance(partial, CompactJobRates):
+                samples = np.frombuffer(partial.samples, dtype=np.float64).reshape(shape)
+                present = np.frombuffer(partial.present, dtype=np.int8).reshape(shape) != 0
+                packed_windows[0].append(rows)
+                packed_windows[1].append(np.frombuffer(partial.windows, dtype=np.int64))
+            else:
+                samples = np.frombuffer(partial.samples, dtype=np.int64).reshape(shape)
+                present = samples != 0
+            cols = np.array([col_index.get(op, -1) for op in partial.ops], dtype=np.int64)
+            samples, present, cols = samples[:, cols >= 0], present[:, cols >= 0], cols[cols >= 0]
+
+            # add up 'ops' column by column, like the dict engine does for rates
+            total = np.zeros(len(partial), dtype=samples.dtype)
+            for col in range(len(cols)):
+                total += np.where(present[:, col], samples[:, col], 0)
+            i, j = np.nonzero(present)
+            packed[0].append(rows[i])
+            packed[1].append(cols[j])
+            packed[2].append(samples[i, j])
+            packed_totals[0].append(rows)
+            packed_totals[1].append(total)
+
+        job_ids = list(index)
+        concat = lambda entries: np.concatenate(entries) if entries else np.zeros(0) # pylint: disable=unnecessary-lambda-assignment
+        matrix = cls.from_samples(ops, job_ids,
+                                  [concat(entries) for entries in packed],
+                                  [concat(entries) for entries in packed_totals],
+                                  [concat(entries) for entries in packed_windows])
+        if table is not None:
+            matrix.job_ids = table.intern(job_ids)
+        return matrix
+
+    @classmethod
+    def from_samples(cls, ops, job_ids, entries, totals, windows): # pylint: disable=too-many-arguments
+        '''
+        build the matrix from (rows, cols, samples) entries in merge order,
+        (rows, ops) totals and (rows, sampling window) pairs. Float samples
+        of rates are rounded like the dict engine rounds them.
+        '''
+        rows, cols = (np.asarray(item, dtype=np.int64) for item in entries[:2])
+        samples = entries[2]
+        shape = (len(job_ids), len(ops))
+        ops_col = ops.index('ops')
+
+        values = np.zeros(shape, dtype=samples.dtype)
+        np.add.at(values, (rows, cols), samples)
+        ops_values = np.zeros(len(job_ids), dtype=samples.dtype)
+        np.add.at(ops_values, np.asarray(totals[0], dtype=np.int64), totals[1])
+        values[:, ops_col] = ops_values
+        if values.dtype != np.int64:
+            values = np.rint(values).astype(np.int64)
+
+        # every operation ranks by its first sample, 'ops' right after the first one
+        rank = np.full(shape, np.iinfo(np.int64).max, dtype=np.int64)
+        np.minimum.at(rank, (rows, cols), np.arange(len(rows), dtype=np.int64) * 2)
+        rank[:, ops_col] = rank.min(axis=1) + 1
+
+        present = np.zeros(shape, dtype=bool)
+        present[rows, cols] = True
+        present[:, ops_col] = present.any(axis=1)
+
+        job_windows = np.zeros(len(job_ids), dtype=np.int64)
+        np.maximum.at(job_windows, np.asarray(windows[0], dtype=np.int64),
+                      np.asarray(windows[1], dtype=np.int64))
+
+        return cls(ops, job_ids, values, present, rank, job_windows)
+
+    def __len__(self):
+        return len(self.job_ids)
+
+    def job_dict(self, row):
+        '''
+        return a single job as dict, like the dict engine would have it
+        '''
+        cols = sorted(np.flatnonzero(self.present[row]), key=lambda col: self.rank[row, col])
+        job = {self.ops[col]: int(self.values[row, col]) for col in cols}
+        job['job_id'] = self.job_ids[row]
+        return job
+
+    def totals(self):
+        '''
+        sum of all jobs for each operation, in the order total_calc finds them
+        '''
+        first_row = self.present.argmax(axis=0)
+        cols = sorted(np.flatnonzero(self.present.any(axis=0)),
+                      key=lambda col: (first_row[col], self.rank[first_row[col], col]))
+        sums = np.where(self.present, self.values, 0).sum(axis=0)
+        return {self.ops[col]: int(sums[col]) for col in cols}
+
+    def percent(self, total_ops):
+        '''
+        operations of each job in percent to total_ops
+        '''
+        totals = np.array([total_ops.get(op, 0) for op in self.ops], dtype=np.int64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            pct = np.round(self.values * 100 / totals)
+        pct = np.where(self.present & (totals != 0), pct, 0).astype(np.int64)
+        return JobMatrix(self.ops, self.job_ids, pct, self.present, self.rank)
+
+    def sort_key(self, rows, name, descending):
+        '''
+        float key of rows for one sortby entry, smaller sorts first and
+        jobs without the operation get inf to go last
+        '''
+        if name == 'job_id':
+            _, key = np.unique(np.array([self.job_ids[row] for row in rows]),
+                               return_inverse=True)
+            key = key.astype(float)
+            return -key if descending else key
+        if name not in self.ops:
+            return np.full(len(rows), np.inf)
+        col = self.ops.index(name)
+        key = self.values[rows, col].astype(float)
+        return np.where(self.present[rows, col], -key if descending else key, np.inf)
+
+    def top_rows(self, count, sort_keys, minrate, keep):
+        '''
+        rows of the count top jobs ordered by the (name, descending) pairs
+        of sort_keys, the last one of them is expected to be unique
+        '''
+        ops_col = self.ops.index('ops')
+        cand = np.flatnonzero((self.values != 0).any(axis=1) &
+                              (self.values[:, ops_col] > minrate))
+        cand = np.array([row for row in cand if keep(self.job_ids[row])], dtype=np.int64)
+        if not len(cand): # pylint: disable=use-implicit-booleaness-not-len
+            return []
+
+        # only rows reaching the count-th value of the first key can make it
+        first = self.sort_key(cand, *sort_keys[0])
+        if count < len(first):
+            bound = np.partition(first, count - 1)[count - 1]
+            cand, first = cand[first <= bound], first[first <= bound]
+
+        keys = [first] + [self.sort_key(cand, *sort_key) for sort_key in sort_keys[1:]]
+        return cand[np.lexsort(keys[::-1])[:count]].tolist()
+
+    def top_per_op(self, count=1):
+        '''
+        rows holding the count first highest values of each operation
+        '''
+        rows = []
+        for col in np.flatnonzero(self.present.any(axis=0)):
+            values = np.where(self.present[:, col], self.values[:, col].astype(float), -np.inf)
+            top = np.argsort(-values, kind='stable')[:count]
+            rows.extend(top[self.present[top, col]].tolist())
+        return sorted(set(rows))
+
+
+class TopRateDB:
+    '''
+    Class to keep the highest total rates and the jobs with the highest
+    rates of each operation in a SQLite database. WAL mode lets several
+    instances share it, only the count highest records per operation are
+    kept and the database is only written when one of them is beaten.
+    '''
+    default_path = expanduser("~/.glljobstat.db")
+    legacy_path = expanduser("~/.glljobstatdb.pickle")
+
+    schema = ('CREATE TABLE IF NOT EXISTS top_ops (op TEXT NOT NULL, rate INTEGER NOT NULL, '
+              'timestamp INTEGER NOT NULL)',
+              'CREATE INDEX IF NOT EXISTS top_ops_rate ON top_ops (op, rate DESC)',
+              'CREATE INDEX IF NOT EXISTS top_ops_time ON top_ops (op, timestamp)',
+              'CREATE TABLE IF NOT EXISTS top_jobs (op TEXT NOT NULL, rate INTEGER NOT NULL, '
+              'timestamp INTEGER NOT NULL, job_id TEXT NOT NULL, job TEXT NOT NULL)',
+              'CREATE INDEX IF NOT EXISTS top_jobs_rate ON top_jobs (op, rate DESC)',
+              'CREATE INDEX IF NOT EXISTS top_jobs_time ON top_jobs (op, timestamp)')
+
+    columns = {'top_ops': 'rate, timestamp', 'top_jobs': 'rate, timestamp, job_id, job'}
+
+    def __init__(self, path, count):
+        self.count = max(count, 1)
+        self.path, legacy = self.db_path(path)
+        self.best = {table: {} for table in self.columns}
+        self.data_version = None
+        try:
+            self.conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('PRAGMA synchronous=NORMAL')
+            for statement in self.schema:
+                self.conn.execute(statement)
+        except sqlite3.Error as err:
+            print(f'Could not open the totalratefile {self.path}: {err}')
+            sys.exit()
+        if legacy:
+            self.import_pickle(legacy)
+        self.refresh()
+
+    @classmethod
+    def db_path(cls, path):
+        '''
+        path of the database and of an old pickle file to import, if any
+        '''
+        if exists(path):
+            with open(path, 'rb') as dbf:
+                if dbf.read(16) == b'SQLite format 3\x00':
+                    return path, None
+            legacy, path = path, splitext(path)[0] + '.db'
+            if path == legacy:
+                path += '.sqlite'
+            return path, None if exists(path) else legacy
+        if path == cls.default_path and exists(cls.legacy_path):
+            return path, cls.legacy_path
+        return path, None
+
+    def import_pickle(self, legacy):
+        '''
+        import the records of an old pickle totalratefile
+        '''
+        try:
+            with open(legacy, 'rb') as picf:
+                old = pickle.load(picf)
+        except Exception as err: # pylint: disable=broad-exception-caught
+            print(f'Could not import the old totalratefile {legacy}: {err}')
+            return
+        rows = {'top_ops': [], 'top_jobs': []}
+        for op, record in old.get("top_ops", {}).items():
+            rows['top_ops'].append((op, record["rate"], record["timestamp"]))
+        for op, job in old.get("top_job_per_op", {}).items():
+            if "job_id" in job and op in job:
+                rows['top_jobs'].append((op, job[op], job["timestamp"], job["job_id"],
+                                         self.job_json(job)))
+        self.write(rows)
+        print(f'Imported the old totalratefile {legacy} into {self.path}')
+
+    @staticmethod
+    def job_json(job):
+        '''
+        the rates of a job without job_id and timestamp as JSON
+        '''
+        return json.dumps({key: value for key, value in job.items() if
+                           key not in ('job_id', 'timestamp')}, separators=(',', ':'))
+
+    def refresh(self):
+        '''
+        reload the records if another instance changed the database
+        '''
+        data_version = self.conn.execute('PRAGMA data_version').fetchone()[0]
+        if data_version == self.data_version:
+            return
+        self.data_version = data_version
+        for table, columns in self.columns.items():
+            best = self.best[table] = {}
+            for row in self.conn.execute(f'SELECT op, {columns} FROM {table} '
+                                         'ORDER BY op, rate DESC, rowid'):
+                best.setdefault(row[0], []).append(row[1:])
+
+    def beats(self, table, op, rate):
+        '''
+        True if rate makes it into the count highest records of op
+        '''
+        records = self.best[table].get(op, ())
+        return len(records) < self.count or rate > records[-1][0]
+
+    def update(self, total_ops, jobs, query_time):
+        '''
+        record the total rates and the jobs beating the highest records of
+        their operation, nothing is written if no record is beaten
+        '''
+        self.refresh()
+        rows = {'top_ops': [(op, rate, query_time) for op, rate in total_ops.items() if
+                            self.beats('top_ops', op, rate)],
+                'top_jobs': []}
+        candidates = {}
+        for job in jobs:
+            for op, rate in job.items():
+                if op != 'job_id' and self.beats('top_jobs', op, rate):
+                    candidates.setdefault(op, []).append(job)
+        for op, op_jobs in candidates.items():
+            for job in heapq.nlargest(self.count, op_jobs, key=lambda job, op=op: job[op]):
+                rows['top_jobs'].append((op, job[op], query_time, job['job_id'],
+                                         self.job_json(job)))
+        if rows['top_ops'] or rows['top_jobs']:
+            self.write(rows)
+
+    def write(self, rows):
+        '''
+        insert the rows of each table and drop the records of their
+        operations which are no longer among the count highest
+        '''
+        try:
+            self.conn.execute('BEGIN IMMEDIATE')
+            for table, table_rows in rows.items():
+                marks = ', '.join('?' * (len(self.columns[table].split(',')) + 1))
+                self.conn.executemany(f'INSERT INTO {table} (op, {self.columns[table]}) '
+                                      f'VALUES ({marks})', table_rows)
+                for op in {row[0] for row in table_rows}:
+                    self.conn.execute(f'DELETE FROM {table} WHERE rowid IN '
+                                      f'(SELECT rowid FROM {table} WHERE op = ? '
+                                      'ORDER BY rate DESC, rowid LIMIT -1 OFFSET ?)',
+                                      (op, self.count))
+            self.conn.execute('COMMIT')
+        except sqlite3.Error as err:
+            if self.conn.in_transaction:
+                self.conn.execute('ROLLBACK')
+            print(f'Could not update the totalratefile {self.path}: {err}')
+        self.data_version = None
+        self.refresh()
+
+    def top(self):
+        '''
+        highest total rate and job with the highest rate of each operation
+        '''
+        top_ops = {op: {"rate": records[0][0], "timestamp": records[0][1]} for
+                   op, records in self.best['top_ops'].items()}
+        top_job_per_op = {}
+        for op, records in self.best['top_jobs'].items():
+            _, timestamp, job_id, job = records[0]
+            top_job_per_op[op] = json.loads(job)
+            top_job_per_op[op].update({"job_id": job_id, "timestamp": timestamp})
+        return {"top_job_per_op": top_job_per_op, "top_ops": top_ops}
+
+    def query(self, table, ops=None, since=None, until=None):
+        '''
+        records of table for ops logged between since and until, highest
+        rates of each operation first
+        '''
+        where, params = [], []
+        if ops is not None:
+            where.append(f'op IN ({", ".join("?" * len(ops))})')
+            params.extend(ops)
+        if since is not None:
+            where.append('timestamp >= ?')
+            params.append(since)
+        if until is not None:
+            where.append('timestamp <= ?')
+            params.append(until)
+        where = f'WHERE {" AND ".join(where)} ' if where else ''
+        return self.conn.execute(f'SELECT op, {self.columns[table]} FROM {table} {where}'
+                                 'ORDER BY op, rate DESC, rowid', params).fetchall()
+
+    def close(self):
+        '''
+        close the database
+        '''
+        self.conn.close()
+
+
+class RateHistory:
+    '''
+    Class to keep the per job rates of every query in a fixed size ring
+    buffer file, accessed through mmap. A record holds the rates of one
+    job during one query window, only jobs with non zero rates are written
+    and the oldest records are overwritten once the ring is full. Job ids
+    are kept once in a name table, records point to their slot there and
+    the generation of the slot tells if the name was replaced since. The
+    name table has a slot per record, so the slot of the least recently
+    written job is only taken over once all of its records are gone.
+    Job ids longer than name_length are not logged.
+    '''
+    magic = b'GLLJRH01'
+    header = struct.Struct('<8sIQIIQ')
+    header_size = 4096
+    name_length = 128
+
+    def __init__(self, path, records=None, ops=None):
+        self.path = path
+        try:
+            if not exists(path):
+                if records is None:
+                    raise FileNotFoundError(f'No such file: {path}')
+                self.create(path, records, ops)
+            self.file = open(path, 'r+b' if records is not None else 'rb') # pylint: disable=consider-using-with
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_WRITE if
+                                 records is not None else mmap.ACCESS_READ)
+        except OSError as err:
+            print(f'Could not open the history file {path}: {err}')
+            sys.exit()
+        self.warned = False
+        self.skipped = 0
+
+        magic, num_ops, self.records, self.names, ops_length, self.head = \
+            self.header.unpack_from(self.map)
+        if magic != self.magic:
+            print(f'{path} is no glljobstat history file')
+            sys.exit()
+        self.ops = bytes(self.map[self.header.size:self.header.size + ops_length]).decode().split(',')
+        self.name_dtype, self.record_dtype = self.dtypes(num_ops)
+        self.name_table = np.frombuffer(self.map, dtype=self.name_dtype, count=self.names,
+                                        offset=self.header_size)
+        self.ring = np.frombuffer(self.map, dtype=self.record_dtype, count=self.records,
+                                  offset=self.header_size + self.name_dtype.itemsize * self.names)
+
+        # job_id -> slot, least recently written first
+        self.slots = OrderedDict()
+        used = np.flatnonzero(self.name_table['generation'])
+        for slot in used[np.argsort(self.name_table['last'][used], kind='stable')]:
+            self.slots[self.name_table['name'][slot].decode(errors='replace')] = int(slot)
+        # never used slots, handed out before any job loses its slot
+        self.free = np.flatnonzero(self.name_table['generation'] == 0)
+        self.next_free = 0
+
+    @classmethod
+    def dtypes(cls, num_ops):
+        '''
+        numpy dtypes of a name table entry and of a record
+        '''
+        return (np.dtype([('generation', '<u4'), ('last', '<u8'),
+                          ('name', f'S{cls.name_length}')]),
+                np.dtype([('timestamp', '<i8'), ('window', '<i4'), ('slot', '<u4'),
+                          ('generation', '<u4'), ('rates', '<f4', (num_ops,))]))
+
+    @classmethod
+    def create(cls, path, records, ops):
+        '''
+        create an empty history file for records records of ops
+        '''
+        records = max(records, 1)
+        names = records
+        ops_bytes = ','.join(ops).encode()
+        name_dtype, record_dtype = cls.dtypes(len(ops))
+        with open(path, 'wb') as hist:
+            hist.write(cls.header.pack(cls.magic, len(ops), records, names, len(ops_bytes), 0))
+            hist.write(ops_bytes)
+            hist.truncate(cls.header_size + name_dtype.itemsize * names +
+                          record_dtype.itemsize * records)
+
+    def slot(self, job_id):
+        '''
+        slot and generation of job_id in the name table, the slot of the
+        least recently written job is taken over once the table is full
+        '''
+        slot = self.slots.get(job_id)
+        if slot is None:
+            if self.next_free < len(self.free):
+                slot = int(self.free[self.next_free])
+                self.next_free += 1
+            else:
+                _, slot = self.slots.popitem(last=False)
+                if self.name_table['last'][slot] + self.records > self.head and not self.warned:
+                    # only history files written by older versions have fewer names
+                    print(f'The name table of {self.path} is too small, the oldest records '
+                          'lose their job_id, recreate it to keep them', file=sys.stderr)
+                    self.warned = True
+            self.name_table['generation'][slot] += 1
+            self.name_table['name'][slot] = job_id.encode()
+            self.slots[job_id] = slot
+        else:
+            self.slots.move_to_end(job_id)
+        self.name_table['last'][slot] = self.head
+        return slot, self.name_table['generation'][slot]
+
+    def append(self, timestamp, job_ids, windows, rates):
+        '''
+        write one record per job, rates holds one row of rates per job with
+        the columns in the order of self.ops
+        '''
+        if not job_ids:
+            return
+        new = np.zeros(len(job_ids), dtype=self.record_dtype)
+        new['timestamp'] = timestamp
+        new['window'] = windows
+        new['rates'] = rates
+        keep = [len(job_id.encode()) <= self.name_length for job_id in job_ids]
+        if not all(keep):
+            if not self.skipped:
+                print(f'Job ids longer than {self.name_length} bytes are not logged to '
+                      f'{self.path}', file=sys.stderr)
+            self.skipped += len(keep) - sum(keep)
+            new = new[np.array(keep)]
+            job_ids = [job_id for job_id, ok in zip(job_ids, keep) if ok]
+        for i, job_id in enumerate(job_ids):
+            new['slot'][i], new['generation'][i] = self.slot(job_id)
+
+        new = new[-self.records:]
+        start = self.head % self.records
+        first = min(len(new), self.records - start)
+        self.ring[start:start + first] = new[:first]
+        self.ring[:len(new) - first] = new[first:]
+        self.head += len(new)
+        self.header.pack_into(self.map, 0, self.magic, len(self.ops), self.records,
+                              self.names, len(','.join(self.ops)), self.head)
+
+    def record(self, index):
+        '''
+        record index of all records still kept, oldest first
+        '''
+        return self.ring[(max(self.head - self.records, 0) + index) % self.records]
+
+    def scan(self, since=None, until=None):
+        '''
+        copy of the records logged between since and until, oldest first.
+        The ring is in time order, so the range is found by bisection and
+        only the records in it are read.
+        '''
+        kept = min(self.head, self.records)
+        timestamps = RecordTimes(self, kept)
+        low = 0 if since is None else bisect.bisect_left(timestamps, since)
+        high = kept if until is None else bisect.bisect_right(timestamps, until)
+        if low >= high:
+            return np.zeros(0, dtype=self.record_dtype)
+        oldest = max(self.head - self.records, 0)
+        start, stop = (oldest + low) % self.records, (oldest + high) % self.records
+        if start < stop:
+            return self.ring[start:stop].copy()
+        return np.concatenate((self.ring[start:], self.ring[:stop]))
+
+    def job_ids(self, records):
+        '''
+        job_id of every record, None if its name slot was taken over since
+        '''
+        names = self.name_table[records['slot']]
+        valid = names['generation'] == records['generation']
+        return [name.decode(errors='replace') if ok else None
+                for name, ok in zip(names['name'], valid)]
+
+    def close(self):
+        '''
+        write the history file back and close it
+        '''
+        if not self.map.closed:
+            if self.file.mode != 'rb':
+                self.map.flush()
+            del self.name_table, self.ring
+            try:
+                self.map.close()
+            except BufferError:
+                pass
+            self.file.close()
+
+
+class RecordTimes: # pylint: disable=too-few-public-methods
+    '''
+    timestamps of the kept history records as a sequence for bisect
+    '''
+    def __init__(self, history, kept):
+        self.history = history
+        self.kept = kept
+
+    def __len__(self):
+        return self.kept
+
+    def __getitem__(self, index):
+        return int(self.history.record(index)['timestamp'])
+
+
+class CaptureDir:
+    '''
+    Class to record the raw job_stats of every query into a directory and
+    to read them back. Each query is one compressed file (zstd if the
+    zstandard module is installed, gzip otherwise) holding a JSON header
+    line with the query time and the size of each target, followed by the
+    raw job_stats of all targets. meta.json keeps what the replay needs
+    to know about the servers.
+    '''
+    meta_name = 'meta.json'
+
+    def __init__(self, path, create=False):
+        self.path = Path(path)
+        try:
+            if create:
+                self.path.mkdir(parents=True, exist_ok=True)
+            self.captures = sorted(capture.name for capture in self.path.iterdir() if
+                                   capture.name.endswith(('.gz', '.zst')))
+        except OSError as err:
+            print(f'Could not open the capture directory {path}: {err}')
+            sys.exit()
+        if not create and not self.captures:
+            print(f'No captures found in {path}')
+            sys.exit()
+        self.position = 0
+
+    def write_meta(self, meta):
+        '''
+        save the information about the queried servers
+        '''
+        with open(self.path / self.meta_name, 'w', encoding='utf-8') as metaf:
+            json.dump(meta, metaf, indent=1)
+
+    def read_meta(self):
+        '''
+        information about the servers the captures were taken from
+        '''
+        try:
+            with open(self.path / self.meta_name, encoding='utf-8') as metaf:
+                return json.load(metaf)
+        except (OSError, ValueError) as err:
+            print(f'Could not read {self.path / self.meta_name}: {err}')
+            sys.exit()
+
+    def write(self, query_time, statsdata):
+        '''
+        save the (target, job_stats) pairs of one query
+        '''
+        header = json.dumps({"query_time": query_time,
+                             "targets": [[target, len(data)] for target, data in statsdata]})
+        name = f'{len(self.captures):06d}-{query_time}'
+        name += '.zst' if zstandard is not None else '.gz'
+        tmp = self.path / f'.{name}.tmp'
+        with open(tmp, 'wb') as capf:
+            if zstandard is not None:
+                out = zstandard.ZstdCompressor(level=3).stream_writer(capf)
+            else:
+                out = gzip.GzipFile(fileobj=capf, mode='wb', compresslevel=1)
+            with out:
+                out.write(header.encode() + b'\n')
+                for _, data in statsdata:
+                    out.write(data)
+        tmp.rename(self.path / name)
+        self.captures.append(name)
+
+    def read(self, name):
+        '''
+        query time and (target, job_stats) pairs of one capture
+        '''
+        with open(self.path / name, 'rb') as capf:
+            if name.endswith('.zst'):
+                if zstandard is None:
+                    print(f'{name} is zstd compressed, the python zstandard module is needed')
+                    sys.exit()
+                data = zstandard.ZstdDecompressor().decompressobj().decompress(capf.read())
+            else:
+                data = gzip.GzipFile(fileobj=capf, mode='rb').read()
+        header, _, data = data.partition(b'\n')
+        header = json.loads(header)
+        statsdata = []
+        offset = 0
+        for target, size in header["targets"]:
+            statsdata.append((target, data[offset:offset + size]))
+            offset += size
+        return header["query_time"], statsdata
+
+    def done(self):
+        '''
+        True once all captures have been read with next()
+        '''
+        return self.position >= len(self.captures)
+
+    def next(self):
+        '''
+        query time and (target, job_stats) pairs of the next capture
+        '''
+        capture = self.read(self.captures[self.position])
+        self.position += 1
+        return capture
+
+
+class LocalStats:
+    '''
+    Class to read parameters straight from the files lctl get_param reads,
+    when glljobstat runs on the OSS/MDS itself. The files are searched
+    below root, which can also be a copy of the trees, and read with large
+    unbuffered reads.
+    '''
+    param_dirs = ['sys/fs/lustre', 'sys/kernel/debug/lustre', 'proc/fs/lustre']
+    bufsize = 1 << 20
+
+    def __init__(self, root='/'):
+        self.root = Path(root)
+        self.host = socket.gethostname()
+        self.paths = {}
+
+    def list_param(self, pattern):
+        '''
+        names of the parameters matching pattern like lctl list_param, the
+        first tree of param_dirs having a parameter wins
+        '''
+        params = {}
+        for param_dir in self.param_dirs:
+            base = self.root / param_dir
+            for path in sorted(base.glob(pattern.replace('.', '/'))):
+                param = '.'.join(path.relative_to(base).parts)
+                if param not in params and path.is_file():
+                    params[param] = path
+        self.paths.update(params)
+        return list(params)
+
+    def get_param(self, param):
+        '''
+        content of the parameter param as bytes
+        '''
+        if param not in self.paths and not self.list_param(param):
+            raise FileNotFoundError(f'No parameter {param} below {self.root}')
+        with open(self.paths[param], 'rb', buffering=0) as paramf:
+            return b''.join(iter(lambda: paramf.read(self.bufsize), b''))
+
+    def get_targets(self, params, verbose=False):
+        '''
+        (target, job_stats) pairs of params, targets which can not be read
+        any more (e.g. unmounted) are left out
+        '''
+        targets = []
+        for param in params:
+            try:
+                targets.append((f'{self.host}:{param}', self.get_param(param)))
+            except OSError as err:
+                if verbose:
+                    print(f'Could not read {param}: {err}')
+        return targets
+
+
+class TickMetrics:
+    '''
+    Class to collect the duration of every stage of a query, the transfer
+    statistics per host and the parse statistics per target, and to write
+    them to the --metrics file. jsonl appends one JSON line per query,
+    prom replaces the file with the last query in the Prometheus text
+    format for the node_exporter textfile collector.
+    '''
+    prom_help = {
+        'query_timestamp_seconds': 'Time of the last query',
+        'tick_seconds': 'Duration of the last query',
+        'jobs': 'Number of jobs of the last query',
+        'skipped_ticks': 'Query starts skipped because the last query ran too long',
+        'stage_seconds': 'Duration of each stage of the last query',
+        'host_connect_seconds': 'Time spent opening SSH connections to the host',
+        'host_exec_seconds': 'Longest run time of a command on the host',
+        'host_first_byte_seconds': 'Longest wait for the first output of a command on the host',
+        'host_received_bytes': 'Bytes received from the host',
+        'host_output_bytes': 'Bytes received from the host after decompression',
+        'host_channels': 'Number of commands run on the host',
+        'host_missing': 'Host did not answer the query in time',
+        'target_parse_seconds': 'Time spent parsing and aggregating the job_stats of the target',
+        'target_jobs': 'Number of jobs of the target after grouping and filtering',
+        'target_bytes': 'Size of the job_stats of the target',
+    }
+
+    def __init__(self, path=None, fmt='jsonl'):
+        self.path = path
+        self.fmt = fmt
+        self.tick = {}
+        self.begin = self.last = time.perf_counter()
+
+    def start(self, query_time):
+        '''
+        begin the metrics of a new query
+        '''
+        self.tick = {'query_time': query_time, 'jobs': 0, 'stages': {}, 'hosts': {},
+                     'targets': {}}
+        self.begin = self.last = time.perf_counter()
+
+    def lap(self, stage):
+        '''
+        account the time since the previous lap to stage
+        '''
+        now = time.perf_counter()
+        stages = self.tick['stages']
+        stages[stage] = stages.get(stage, 0) + now - self.last
+        self.last = now
+
+    def set(self, **values):
+        '''
+        set values of the query
+        '''
+        self.tick.update(values)
+
+    def hosts(self, transfer_stats, connect_times, missing=()):
+        '''
+        add the transfer statistics and SSH connect times per host
+        '''
+        for host in set(transfer_stats) | set(connect_times) | set(missing):
+            wire_bytes, raw_bytes, seconds, first_byte, channels = transfer_stats.get(
+                host, (0, 0, 0, 0, 0))
+            self.tick['hosts'][host] = {'connect_seconds': connect_times.get(host, 0),
+                                        'exec_seconds': seconds,
+                                        'first_byte_seconds': first_byte,
+                                        'received_bytes': wire_bytes,
+                                        'output_bytes': raw_bytes,
+                                        'channels': channels,
+                                        'missing': int(host in missing)}
+
+    def target(self, target, **values):
+        '''
+        add statistics of a target
+        '''
+        self.tick['targets'].setdefault(target, {}).update(values)
+
+    @staticmethod
+    def label(name, value):
+        '''
+        name="value" with the escapes the Prometheus text format knows
+        '''
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        return f'{name}="{value}"'
+
+    def samples(self):
+        '''
+        all metrics of the query as (name, labels, value)
+        '''
+        tick = self.tick
+        yield 'query_timestamp_seconds', '', tick['query_time']
+        yield 'tick_seconds', '', tick['tick_seconds']
+        yield 'jobs', '', tick['jobs']
+        yield 'skipped_ticks', '', tick.get('skipped_ticks', 0)
+        for stage, seconds in tick['stages'].items():
+            yield 'stage_seconds', self.label('stage', stage), seconds
+        for kind in ('host', 'target'):
+            for name, values in sorted(tick[f'{kind}s'].items()):
+                for key, value in values.items():
+                    yield f'{kind}_{key}', self.label(kind, name), value
+
+    def prometheus(self):
+        '''
+        the metrics of the query in the Prometheus text format
+        '''
+        series = {}
+        for name, labels, value in self.samples():
+            series.setdefault(name, []).append(
+                f'glljobstat_{name}{{{labels}}} {value}' if labels else
+                f'glljobstat_{name} {value}')
+        lines = []
+        for name, samples in series.items():
+            lines += [f'# HELP glljobstat_{name} {self.prom_help[name]}',
+                      f'# TYPE glljobstat_{name} gauge'] + samples
+        return '\n'.join(lines) + '\n'
+
+    def write(self):
+        '''
+        write the metrics of the query, the prom file is replaced atomically
+        so a collector never reads it half written
+        '''
+        if not self.path or not self.tick:
+            return
+        self.tick['tick_seconds'] = time.perf_counter() - self.begin
+        try:
+            if self.fmt == 'prom':
+                tmp = Path(f'{self.path}.tmp')
+                tmp.write_text(self.prometheus(), encoding='utf-8')
+                tmp.replace(self.path)
+            else:
+                with open(self.path, 'a', encoding='utf-8') as metricsf:
+                    metricsf.write(json.dumps(self.tick, separators=(',', ':')) + '\n')
+        except OSError as err:
+            print(f'Could not write the metrics to {self.path}: {err}')
+            sys.exit()
+        self.tick = {}
+
+
+class TickScheduler:
+    '''
+    Class to start the queries on multiples of the interval since the
+    epoch, so the period does not grow by the query time and the queries
+    line up with other monitoring. A query running past the next start
+    skips the starts it missed, the overruns are counted.
+    '''
+    def __init__(self, interval):
+        self.interval = interval
+        self.tick_start = time.time()
+        self.tick_due = None
+        self.scheduled = None
+        self.ticks = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.partial = 0
+        self.max_overrun = 0
+
+    def start(self):
+        '''
+        mark the start of a query, it is due to be done by the next start.
+        The first query is not started on a multiple of the interval, it
+        gets a whole interval.
+        '''
+        self.tick_start = time.time()
+        if self.interval > 0 and self.scheduled is None:
+            self.tick_due = self.tick_start + self.interval
+        elif self.interval > 0:
+            # the scheduled start, time.time() may be a bit short of it
+            self.tick_due = (self.scheduled // self.interval + 1) * self.interval
+        self.scheduled = None
+        self.ticks += 1
+
+    def deadline(self, limit):
+        '''
+        time the query has to be done by with a limit in seconds
+        '''
+        return self.tick_start + limit if limit > 0 else None
+
+    def finish(self):
+        '''
+        mark the end of a query, return the number of starts it ran past
+        '''
+        if self.interval <= 0:
+            return 0
+        now = time.time()
+        missed = int((now - self.tick_due) // self.interval + 1) if now >= self.tick_due else 0
+        if missed:
+            self.overruns += 1
+            self.skipped += missed
+            self.max_overrun = max(self.max_overrun, now - self.tick_due)
+        return missed
+
+    def sleep(self):
+        '''
+        sleep until the next start
+        '''
+        if self.interval > 0:
+            self.scheduled = (time.time() // self.interval + 1) * self.interval
+            time.sleep(max(self.scheduled - time.time(), 0))
+
+
+class JobStatsServer(ThreadingHTTPServer):
+    '''
+    Class to serve the jobs of the last query from memory over HTTP, so any
+    number of consumers share one collection. /metrics is the Prometheus
+    text format with the total rates and the rates of the --serve_jobs top
+    jobs, it is rendered once per query. /top?count=N&sortby=KEYS returns
+    the top jobs and the total rates as JSON.
+    '''
+    daemon_threads = True
+    max_cached = 64
+
+    def __init__(self, address, parser):
+        super().__init__(address, JobStatsHandler)
+        self.parser = parser
+        self.snapshot = None
+
+    @staticmethod
+    def address(serve):
+        '''
+        (host, port) of a [HOST:]PORT argument, localhost by default
+        '''
+        host, _, port = serve.rpartition(':')
+        return host or '127.0.0.1', int(port)
+
+    def publish(self, query_time, query_duration, total_jobs, totals, top):
+        '''
+        replace the served query, top(count, sort_keys) picks the top jobs
+        of it and is called from the request threads
+        '''
+        snapshot = {'query_time': query_time, 'query_duration': query_duration,
+                    'total_jobs': total_jobs, 'totals': totals, 'top': top, 'cache': {},
+                    'missing_hosts': sorted(self.parser.missing_hosts)}
+        snapshot['metrics'] = self.prometheus(
+            snapshot, top(self.parser.args.serve_jobs, self.parser.sort_keys)).encode()
+        self.snapshot = snapshot
+
+    @staticmethod
+    def prometheus(snapshot, top_jobs):
+        '''
+        the query in the Prometheus text format, one series per operation
+        of the total and of each of the top jobs
+        '''
+        lines = ['# HELP glljobstat_query_timestamp_seconds Time of the last query',
+                 '# TYPE glljobstat_query_timestamp_seconds gauge',
+                 f'glljobstat_query_timestamp_seconds {snapshot["query_time"]}',
+                 '# HELP glljobstat_jobs Number of jobs of the last query',
+                 '# TYPE glljobstat_jobs gauge',
+                 f'glljobstat_jobs {snapshot["total_jobs"]}',
+                 '# HELP glljobstat_missing_hosts Number of hosts which did not answer in time',
+                 '# TYPE glljobstat_missing_hosts gauge',
+                 f'glljobstat_missing_hosts {len(snapshot["missing_hosts"])}',
+                 '# HELP glljobstat_total_rate Operations per second of all jobs',
+                 '# TYPE glljobstat_total_rate gauge']
+        lines += [f'glljobstat_total_rate{{{TickMetrics.label("op", op)}}} {rate}'
+                  for op, rate in snapshot['totals'].items()]
+        lines += ['# HELP glljobstat_job_rate Operations per second of the top jobs',
+                  '# TYPE glljobstat_job_rate gauge']
+        for job in top_jobs:
+            job_id = TickMetrics.label('job_id', job['job_id'])
+            lines += [f'glljobstat_job_rate{{{job_id},{TickMetrics.label("op", op)}}} {rate}'
+                      for op, rate in job.items() if op != 'job_id']
+        return '\n'.join(lines) + '\n'
+
+    def top_json(self, snapshot, query):
+        '''
+        JSON of the top jobs of the query string parameters count and sortby,
+        the answers are cached until the next query
+        '''
+        count = int(query.get('count', [self.parser.args.count])[0])
+        sortby = query.get('sortby', [None])[0]
+        sort_keys = self.parser.sortby_keys(sortby) if sortby else self.parser.sort_keys
+        key = (count, tuple(sort_keys))
+        cache = snapshot['cache']
+        body = cache.get(key)
+        if body is None:
+            if len(cache) >= self.max_cached:
+                cache.clear()
+            body = cache[key] = json.dumps({
+                'timestamp': snapshot['query_time'],
+                'query_duration': snapshot['query_duration'],
+                'total_jobs': snapshot['total_jobs'],
+                'missing_hosts': snapshot['missing_hosts'],
+                'totals': snapshot['totals'],
+                'top_jobs': snapshot['top'](count, sort_keys)}).encode()
+        return body
+
+
+class JobStatsHandler(BaseHTTPRequestHandler):
+    '''
+    Class to answer the requests to JobStatsServer
+    '''
+    def do_GET(self): # pylint: disable=invalid-name
+        '''
+        /metrics or /top of the last query
+        '''
+        url = urlsplit(self.path)
+        snapshot = self.server.snapshot
+        if url.path not in ['/metrics', '/top']:
+            self.reply(404, b'Only /metrics and /top are served\n')
+        elif snapshot is None:
+            self.reply(503, b'No query has finished yet\n')
+        elif url.path == '/metrics':
+            self.reply(200, snapshot['metrics'], 'text/plain; version=0.0.4')
+        else:
+            try:
+                body = self.server.top_json(snapshot, parse_qs(url.query))
+            except ValueError as err:
+                self.reply(400, f'{err}\n'.encode())
+                return
+            self.reply(200, body, 'application/json')
+
+    def reply(self, status, body, content_type='text/plain'):
+        '''
+        send status and body
+        '''
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args): # pylint: disable=redefined-builtin
+        '''
+        requests are only logged with -v
+        '''
+        if self.server.parser.args.verb:
+            super().log_message(format, *args)
+
 
 class JobStatsParser:
     '''
@@ -253,6 +2208,9 @@ class JobStatsParser:
         'wb' : 'write_bytes'
     }
 
+    worker = None
+    group_cache_size = 1 << 18
+
     op_keys_rev = {
         'ops'        : 'ops',
         'create'     : 'cr',
@@ -300,6 +2258,87 @@ class JobStatsParser:
         '%h' : 'host',
     }
 
+    batch_marker = '### glljobstat target:'
+
+    compress_cmds = {
+        'zstd': 'zstd -q -c -1',
+        'gzip': 'gzip -c -1',
+        'xz'  : 'xz -c -0',
+    }
+
+    # Helper run with the remote python (2 or 3) by --agent. It reads the
+    # job_stats of every param given as argument and prints one compact JSON
+    # document with the non zero samples of every job and its timestamps:
+    # {"targets": {param: {"ops": [op, ...],
+    #                      "jobs": [[job_id, snapshot, start, elapsed,
+    #                                op_index, samples, ...], ...]}}}
+    # With --delta STATE GEN it keeps the previous snapshot in the file STATE
+    # on tmpfs and only sends the jobs which changed since generation GEN plus
+    # the ids of jobs which are gone, or everything ("full") if GEN is not the
+    # generation of the file. The new generation is returned as "gen".
+    agent_script = '''
+import os, sys, json, time, subprocess
+times = {'snapshot_time:': 1, 'start_time:': 2, 'elapsed_time:': 3}
+args = sys.argv[1:]
+state_file = None
+if args[:1] == ['--delta']:
+    state_dir = '/dev/shm' if os.path.isdir('/dev/shm') else '/tmp'
+    state_file, gen, args = os.path.join(state_dir, args[1]), int(args[2]), args[3:]
+targets = {}
+for param in args:
+    jobs, job = [], None
+    proc = subprocess.Popen(['lctl', 'get_param', '-n', param], stdout=subprocess.PIPE)
+    for line in proc.stdout:
+        fields = line.decode('utf-8', 'replace').split()
+        if len(fields) < 2:
+            continue
+        if fields[0] == '-' and fields[1] == 'job_id:':
+            job = [fields[2], None, None, None]
+            jobs.append(job)
+        elif job is None:
+            continue
+        elif fields[0] in times:
+            job[times[fields[0]]] = int(fields[1].split('.')[0])
+        elif len(fields) > 3 and fields[2] == 'samples:':
+            samples = int(fields[3].rstrip(','))
+            if samples:
+                job.extend((fields[0].rstrip(':'), samples))
+    proc.wait()
+    targets[param] = jobs
+out = {'targets': {}}
+if state_file:
+    try:
+        with open(state_file) as state:
+            previous = json.load(state)
+    except (IOError, OSError, ValueError):
+        previous = {'gen': 0, 'targets': {}}
+    full = gen == 0 or previous['gen'] != gen
+    out.update({'gen': max(previous['gen'], gen) + 1, 'full': full})
+    state = {'gen': out['gen'], 'targets': {}}
+for param, jobs in targets.items():
+    gone = []
+    if state_file:
+        state['targets'][param] = dict((job[0], list(job)) for job in jobs)
+        if not full:
+            old = previous['targets'].get(param, {})
+            jobs = [job for job in jobs if old.get(job[0]) != job]
+            gone = [job_id for job_id in old if job_id not in state['targets'][param]]
+    ops = {}
+    for job in jobs:
+        for i in range(4, len(job), 2):
+            job[i] = ops.setdefault(job[i], len(ops))
+    out['targets'][param] = {'ops': sorted(ops, key=ops.get), 'jobs': jobs, 'gone': gone}
+if state_file:
+    with open(state_file + '.tmp', 'w') as tmp:
+        tmp.write(json.dumps(state, separators=(',', ':')))
+    os.rename(state_file + '.tmp', state_file)
+    for name in os.listdir(state_dir):
+        path = os.path.join(state_dir, name)
+        if name.startswith('glljobstat-') and time.time() - os.path.getmtime(path) > 3600:
+            os.remove(path)
+sys.stdout.write(json.dumps(out, separators=(',', ':')))
+'''
+
     def __init__(self):
         self.args = None
         self.argparser = None
@@ -310,87 +2349,61 @@ class JobStatsParser:
         self.reference = {}
         self.jobid_var = {}
         self.jobid_separator = None
-
-    def topdb(self, total_ops, jobs, query_time): # pylint: disable=too-many-locals,too-many-branches,too-many-statements
+        self.ssh_pool = None
+        self.collector = None
+        self.parse_pool = None
+        self.transfer_stats = {}
+        self.transfer_lock = threading.Lock()
+        self.delta_name = f'glljobstat-{uuid.uuid4().hex}'
+        self.delta_gen = {}
+        self.delta_state = {}
+        self.op_names = set(self.op_keys.values())
+        self.sort_keys = [('ops', True), ('job_id', False)]
+        self.hidden_jobs = None
+        self.group_cache = OrderedDict()
+        self.job_table = JobIdTable()
+        self.target_counters = {}
+        self.top_db = None
+        self.history = None
+        self.captures = None
+        self.replay_start = None
+        self.jobid_name = None
+        self.metrics = TickMetrics()
+        self.server = None
+        self.collect_deadline = None
+        self.missing_hosts = set()
+        self.missed_queries = Counter()
+        self.last_results = []
+        self.local = None
+
+    def __getstate__(self):
+        '''
+        Connections, pools and reference data stay in the main process
+        '''
+        state = self.__dict__.copy()
+        state.update({'ssh_pool': None, 'collector': None, 'parse_pool': None,
+                      'reference': {}, 'reference_snaptime': None,
+                      'transfer_stats': {}, 'transfer_lock': None,
+                      'delta_gen': {}, 'delta_state': {},
+                      'group_cache': OrderedDict(), 'job_table': JobIdTable(),
+                      'target_counters': {}, 'top_db': None, 'history': None,
+                      'captures': None, 'metrics': None, 'server': None,
+                      'last_results': [], 'local': None})
+        return state
+
+    def topdb(self, total_ops, jobs, query_time):
         '''
         Class to upate/read the ever highest ops rate picks
         '''
-        topdbdict = {"top_job_per_op": {}, "top_ops": {}}
-
-        try:
-            with open(self.args.totalratefile, 'rb') as picf:
-                oldjobs = pickle.load(picf)
-        except FileNotFoundError:
-            with open(self.args.totalratefile, 'wb') as picf:
-                pickle.dump(topdbdict, picf, pickle.HIGHEST_PROTOCOL)
-            return False
-
-        try:
-            top_jop_op = oldjobs["top_job_per_op"]
-        except KeyError:
-            top_jop_op = {}
-
-        for opkey in self.op_keys:
-            longopkey = self.op_keys[opkey]
-
-            try:
-                top_jop_op[longopkey]
-            except KeyError:
-                top_jop_op.update({longopkey: {}})
-
-            for jobkey in jobs.keys():
-                if longopkey in jobs[jobkey].keys():
-                    try:
-                        toprate = top_jop_op[longopkey][longopkey]
-                    except KeyError:
-                        top_jop_op[longopkey] = jobs[jobkey]
-                        top_jop_op[longopkey].update({"timestamp": query_time})
-                        continue
-
-                    rate = jobs[jobkey][longopkey]
-
-                    if toprate < rate:
-                        top_jop_op[longopkey] = jobs[jobkey]
-                        top_jop_op[longopkey].update({"timestamp": query_time})
-
-        topdbdict["top_job_per_op"] = top_jop_op
-
-        # -----------------------------------------------------------------------------------------
-
-        newtopops = {}
-        stamped_ops = {}
-
-        for ops in total_ops.keys():
-            stamped_ops.update({ops: {"rate": total_ops[ops], "timestamp": query_time}})
-
-        for ops in oldjobs["top_ops"].keys():
-            oldops = oldjobs["top_ops"][ops]["rate"]
-            oldts = oldjobs["top_ops"][ops]["timestamp"]
-
-            try:
-                newops = stamped_ops[ops]["rate"]
-            except KeyError:
-                newtopops.update({ops: {"rate": oldops, "timestamp": oldts}})
-                continue
-
-            newts = stamped_ops[ops]["timestamp"]
-            if newops > oldops:
-                newtopops.update({ops:{"rate": newops, "timestamp": newts}})
-            else:
-                newtopops.update({ops: {"rate": oldops, "timestamp": oldts}})
-
-            stamped_ops.pop(ops, None)
-
-        if stamped_ops:
-            newtopops.update(stamped_ops)
-
-
-        topdbdict["top_ops"] = newtopops
+        if self.top_db is None:
+            self.top_db = TopRateDB(self.argparser.totalratefile, self.args.totalratenum)
+        self.top_db.update(total_ops, jobs.values(), query_time)
 
-        with open(self.args.totalratefile, 'wb') as picf:
-            pickle.dump(topdbdict, picf, pickle.HIGHEST_PROTOCOL)
-
-        return topdbdict
+        # same order of the operations as before, whatever order SQLite returns
+        top = self.top_db.top()
+        for key, records in top.items():
+            top[key] = {op: records[op] for op in self.op_keys.values() if op in records}
+        return top
 
 
     def rate_calc(self, jobs, query_time, timestamp_dict): # pylint: disable=too-many-branches,too-many-locals
@@ -432,7 +2445,7 @@ class JobStatsParser:
 
 
                 for metric in self.reference[job_id]:
-                    if metric in self.op_keys.values():
+                    if metric in self.op_names:
                         old = self.reference[job_id][metric]
                         try:
                             new = jobs[job_id][metric]
@@ -469,7 +2482,7 @@ class JobStatsParser:
         for job_id in jobs:
             jobpct[job_id] = {}
             for metric in jobs[job_id]:
-                if metric in self.op_keys.values():
+                if metric in self.op_names:
                     try:
                         j_ops = jobs[job_id][metric]
                     except KeyError:
@@ -495,7 +2508,7 @@ class JobStatsParser:
 
         for job_id in jobs:
             for metric in jobs[job_id]:
-                if metric in self.op_keys.values():
+                if metric in self.op_names:
                     try:
                         total_dict[metric] += jobs[job_id][metric]
                     except KeyError:
@@ -593,26 +2606,42 @@ class JobStatsParser:
         return jobstats_dict
 
 
+    def group_jobid(self, jobid):
+        '''
+        return the job_id jobs are aggregated by according to --groupby,
+        the same job_ids come back every query so the result is kept in
+        a LRU cache
+        '''
+        if self.args.groupby == "none":
+            return jobid
+        group = self.group_cache.get(jobid)
+        if group is not None:
+            self.group_cache.move_to_end(jobid)
+            return group
+
+        group = jobid.replace('"', '')
+        if self.jobid_separator in group:
+            splitted = group.split(self.jobid_separator)
+            group = splitted[self.jobid_var[self.args.groupby]]
+        group = '"' + group + '"'
+        if len(self.group_cache) >= self.group_cache_size:
+            self.group_cache.popitem(last=False)
+        self.group_cache[jobid] = group
+        return group
+
+
     def merge_job(self, jobs, job, timestamp_dict):
         '''
         merge stats data of job to jobs
         '''
-        jobid = job['job_id']
-        jobid_ori = job['job_id']
+        jobid = self.group_jobid(job['job_id'])
 
-        if self.args.groupby != "none":
-            jobid = jobid.replace('"', '')
-            if self.jobid_separator in jobid:
-                splitted = jobid.split(self.jobid_separator)
-                jobid = splitted[self.jobid_var[self.args.groupby]]
-            jobid = '"' + jobid + '"'
-        
         job2 = jobs.get(jobid, {})
 
         if jobid not in timestamp_dict:
             timestamp_dict[jobid] = {}
 
-        include_metrics = list(self.op_keys.values())
+        include_metrics = self.op_names
         timestamp_id = ["snapshot_time", "start_time", "elapsed_time"]
 
         # job.keys() = dict_keys(['job_id', 'snapshot_time', 'start_time', 'elapsed_time', 'open', 'close', 'mknod', 'link', 'unlink', 'mkdir', 'rmdir', 'rename', 'getattr', 'setattr', 'getxattr', 'setxattr', 'statfs', 'sync', 'samedir_rename', 'parallel_rename_file', 'parallel_rename_dir', 'crossdir_rename', 'read', 'write', 'read_bytes', 'write_bytes', 'punch', 'migrate'])
@@ -641,48 +2670,104 @@ class JobStatsParser:
         job2['job_id'] = jobid
         jobs[jobid] = job2
 
-    def insert_job_sorted(self, top_jobs, count, job):
+    def parse_sortby(self, sortby):
         '''
-        insert job to top_jobs in descending order by the key job['ops'].
-        top_jobs is an array with at most count elements
+        parse --sortby, terminate if it is not valid
         '''
-        if job["ops"] > self.args.minrate:
-            top_jobs.append(job)
-
-        for i in range(len(top_jobs) - 2, -1, -1):
-            try:
-                if self.args.sortby not in top_jobs[i]:
-                    top_jobs[i + 1] = top_jobs[i]
-                    top_jobs[i] = job
-                elif job[self.args.sortby] > top_jobs[i][self.args.sortby]:
-                    top_jobs[i + 1] = top_jobs[i]
-                    top_jobs[i] = job
-                else :
-                    break
-            except KeyError:
-                pass
+        try:
+            return self.sortby_keys(sortby)
+        except ValueError as err:
+            print(err)
+            sys.exit()
 
-        if len(top_jobs) > count:
-            top_jobs.pop()
+    def sortby_keys(self, sortby):
+        '''
+        parse a sortby string into (name, descending) pairs, e.g. "wr,rd" or
+        "ops desc, job_id asc". Operations sort descending and job_id
+        ascending by default, job_id is appended as final tie-break.
+        '''
+        sort_keys = []
+        for entry in sortby.split(','):
+            words = entry.split()
+            if not words or len(words) > 2 or (len(words) == 2 and
+                                               words[1].lower() not in ['asc', 'desc']):
+                raise ValueError(f"sortby argument entry '{entry.strip()}' is not "
+                                 "'key [asc|desc]'")
+            name = self.op_keys.get(words[0], words[0])
+            if name not in self.op_keys_rev and name != 'job_id':
+                raise ValueError(f"sortby argument key {words[0]} is not in ops key list\n"
+                                 f"ops key list:\n{self.op_keys_rev.keys()}")
+            descending = name != 'job_id' if len(words) == 1 else words[1].lower() == 'desc'
+            sort_keys.append((name, descending))
+        if 'job_id' not in [name for name, _ in sort_keys]:
+            sort_keys.append(('job_id', False))
+        return sort_keys
+
+    @staticmethod
+    def sort_value(job, name, descending):
+        '''
+        value of a job dict for one sortby entry, smaller sorts first and
+        jobs without the operation get inf to go last
+        '''
+        value = job.get(name)
+        if value is None:
+            return float('inf')
+        if isinstance(value, list):
+            value = value[0]
+        if isinstance(value, str):
+            # reverse string order, the end marker puts longer strings first
+            return tuple(-ord(char) for char in value) + (1,) if descending else value
+        return -value if descending else value
+
+    def job_sort_key(self, job, sort_keys=None):
+        '''
+        key of a job dict for all sort_keys, --sortby by default
+        '''
+        return tuple(self.sort_value(job, name, descending)
+                     for name, descending in sort_keys or self.sort_keys)
 
+    def top_candidate(self, job):
+        '''
+        job has non zero values, passes the filter and the minimal rate
+        '''
+        ops = job.get('ops', 0)
+        if isinstance(ops, int) and ops != 0:
+            return ops > self.args.minrate and self.keep_job(job['job_id'])
+        return (any(val != 0 and isinstance(val, int) for val in job.values()) and
+                self.keep_job(job['job_id']) and ops > self.args.minrate)
 
     def pick_top_jobs(self, jobs, count):
         '''
-        choose at most count elements from jobs, put them in an array in
-        descending order by the key job['ops'].
+        choose at most count elements from jobs, put them in an array
+        ordered by the sort_keys. A bounded heap on the first key finds
+        the count-th value, only jobs up to it are sorted by all keys.
         '''
-        top_jobs = []
-        for _, job in jobs.items():
-            if not any(val != 0 and isinstance(val, int) for val in job.values()):
-                continue
-            if self.args.fmod:
-                if any(srv in str(job['job_id']) for srv in self.argparser.filter):
-                    self.insert_job_sorted(top_jobs, count, job)
-            else:
-                if not any(srv in str(job['job_id']) for srv in self.argparser.filter):
-                    self.insert_job_sorted(top_jobs, count, job)
+        return self.sort_top_jobs([job for job in jobs.values() if self.top_candidate(job)],
+                                  count, self.sort_keys)
 
-        return top_jobs
+    def sort_top_jobs(self, jobs, count, sort_keys):
+        '''
+        the count first of the candidate jobs ordered by sort_keys
+        '''
+        name, descending = sort_keys[0]
+        candidates = [(self.sort_value(job, name, descending), job) for job in jobs]
+        if count <= 0 or not candidates:
+            return []
+        if count < len(candidates):
+            bound = heapq.nsmallest(count, (first for first, _ in candidates))[-1]
+            candidates = [(first, job) for first, job in candidates if first <= bound]
+        return sorted((job for _, job in candidates),
+                      key=lambda job: self.job_sort_key(job, sort_keys))[:count]
+
+
+    def keep_job(self, job_id):
+        '''
+        apply the job_id filter, --fmod turns it into an include list
+        '''
+        if self.hidden_jobs is not None:
+            return job_id not in self.hidden_jobs
+        matched = self.argparser.filter.match(job_id)
+        return matched if self.args.fmod else not matched
 
 
     def print_job(self, job, sampling_window):
@@ -738,6 +2823,8 @@ class JobStatsParser:
         if self.args.rate or self.args.difference:
             print(f'query_duration: {query_duration}')
         print(f'servers_queried: {len(self.argparser.serverlist)}')
+        if self.missing_hosts:
+            print(f'servers_missing: [{", ".join(sorted(self.missing_hosts))}]')
         print(f'osts_queried: {self.osts_mdts["obdfilter"]}')
         print(f'mdts_queried: {self.osts_mdts["mdt"]}')
         print(f'total_jobs: {total_jobs}')
@@ -857,6 +2944,172 @@ class JobStatsParser:
         if not self.args.totalrate:
             print('...') # mark the end of YAML doc in stream
 
+    def record_history(self, jobs, job_sampling_window, query_time):
+        '''
+        append the rates of the jobs with non zero rates to the historyfile,
+        jobs is the dict of the dict engine or a JobMatrix
+        '''
+        if self.history is None:
+            self.history = RateHistory(self.args.historyfile, self.args.historysize,
+                                       [op for op in self.op_keys.values() if
+                                        op not in ('read_bytes', 'write_bytes')])
+        ops = self.history.ops
+        if isinstance(jobs, JobMatrix):
+            cols = [jobs.ops.index(op) if op in jobs.ops else None for op in ops]
+            values = np.where(jobs.present, jobs.values, 0)
+            rows = np.flatnonzero(values.any(axis=1))
+            rates = np.zeros((len(rows), len(ops)), dtype=np.float32)
+            for i, col in enumerate(cols):
+                if col is not None:
+                    rates[:, i] = values[rows, col]
+            self.history.append(query_time, [jobs.job_ids[row] for row in rows],
+                                jobs.windows[rows], rates)
+            return
+        job_ids, rates = [], []
+        for job in jobs.values():
+            job_rates = [job.get(op, 0) for op in ops]
+            if any(job_rates):
+                job_ids.append(job['job_id'])
+                rates.append(job_rates)
+        self.history.append(query_time, job_ids,
+                            [job_sampling_window[job_id] for job_id in job_ids], rates)
+
+    def print_history_query(self): # pylint: disable=too-many-locals
+        '''
+        print top jobs, operations of all jobs or every record of a time
+        range of the historyfile in YAML
+        '''
+        if np is None:
+            print('query needs the python numpy module')
+            sys.exit()
+        history = RateHistory(self.args.historyfile)
+        op = self.op_keys.get(self.args.query_op, self.args.query_op)
+        if op not in history.ops:
+            print(f'Unknown operation "{self.args.query_op}" in --query_op, available: '
+                  f'{", ".join(self.op_keys_rev[op] for op in history.ops)}')
+            sys.exit()
+        records = history.scan(self.parse_time(self.args.since), self.parse_time(self.args.until))
+        job_ids = history.job_ids(records)
+        lost = job_ids.count(None)
+        if lost:
+            print(f'{lost} records of {self.args.historyfile} lost their job_id, the name '
+                  'table is too small, recreate the file to keep them', file=sys.stderr)
+        keep = np.array([job_id is not None and (not self.args.filter or
+                                                 self.argparser.filter.match(job_id))
+                         for job_id in job_ids], dtype=bool)
+        records = records[keep]
+        job_ids = [job_id for job_id, kept in zip(job_ids, keep) if kept]
+
+        if self.args.query_mode == 'scan':
+            # records are in time order, one query after the other
+            bounds = np.flatnonzero(np.diff(records['timestamp'])) + 1
+            for rows in np.split(np.arange(len(records)), bounds):
+                if len(rows): # pylint: disable=use-implicit-booleaness-not-len
+                    self.print_top_jobs_history(records, job_ids, rows, history.ops)
+            history.close()
+            return
+
+        # operations of each job during its windows
+        names, rows = np.unique(np.array(job_ids, dtype=object).astype(str), return_inverse=True)
+        operations = np.zeros((len(names), len(history.ops)))
+        np.add.at(operations, rows, records['rates'] * records['window'][:, None])
+        operations = np.rint(operations).astype(np.int64)
+
+        print('---')
+        print(f'historyfile: {self.args.historyfile}')
+        for name, row in (('first', 0), ('last', -1)):
+            stamp = int(records['timestamp'][row]) if len(records) else 0
+            if self.args.humantime and stamp:
+                stamp = time.strftime("%a %d %b %Y %H-%M-%S +0000", time.localtime(stamp))
+            print(f'{name}_timestamp: {stamp}')
+        print(f'total_jobs: {len(names)}')
+        if self.args.query_mode == 'sum':
+            print('total_operations:')
+            totals = dict(zip(history.ops, operations.sum(axis=0).tolist()))
+            for key in sorted(totals, key=lambda key: totals[key], reverse=True):
+                op_name = key if self.args.fullname else self.op_keys_rev[key]
+                print(f'- {op_name + ":" : <10} {{ops: {totals[key]}}}')
+        else:
+            col = history.ops.index(op)
+            top = [row for row in np.lexsort((np.arange(len(names)), -operations[:, col]))
+                   if operations[row, col]][:self.args.count]
+            print(f'top_{self.args.count}_jobs_by_{op}:', end='')
+            print(' []' if not top else '')
+            for row in top:
+                job = {key: int(value) for key, value in zip(history.ops, operations[row])
+                       if value}
+                job['job_id'] = str(names[row])
+                self.print_job(job, False)
+        print('...')
+        history.close()
+
+    def print_top_jobs_history(self, records, job_ids, rows, ops):
+        '''
+        print the records of one query of the historyfile like the top jobs
+        '''
+        timestamp = int(records['timestamp'][rows[0]])
+        print('---')
+        if self.args.humantime:
+            print(f'timestamp: {time.strftime("%a %d %b %Y %H-%M-%S +0000", time.localtime(timestamp))}')
+        else:
+            print(f'timestamp: {timestamp}')
+        print('job_operation_rates_during_query_windows:')
+        for i in rows:
+            job = {key: round(float(value)) for key, value in zip(ops, records['rates'][i])
+                   if value}
+            job['job_id'] = job_ids[i]
+            self.print_job(job, int(records['window'][i]))
+        print('...')
+
+    @staticmethod
+    def parse_time(value):
+        '''
+        seconds since the epoch of a -trs/-tru time
+        '''
+        if value is None:
+            return None
+        try:
+            return int(value) if value.isdigit() else int(datetime.fromisoformat(value).timestamp())
+        except ValueError:
+            print(f'Invalid time "{value}", use seconds since the epoch or "YYYY-MM-DD[ HH:MM[:SS]]"')
+            sys.exit()
+
+    def print_topdb_query(self):
+        '''
+        print the highest rates kept in the totalratefile for -trq in YAML
+        '''
+        ops = None
+        if self.args.totalratequery != 'all':
+            ops = []
+            for name in self.args.totalratequery.split(','):
+                name = name.strip()
+                if name not in self.op_keys and name not in self.op_keys_rev:
+                    print(f'Unknown operation "{name}" in --totalratequery, available: '
+                          f'{", ".join(self.op_keys)}')
+                    sys.exit()
+                ops.append(self.op_keys.get(name, name))
+        since, until = self.parse_time(self.args.since), self.parse_time(self.args.until)
+
+        if not exists(self.argparser.totalratefile):
+            print(f'totalratefile {self.argparser.totalratefile} not found')
+            sys.exit()
+        top_db = TopRateDB(self.argparser.totalratefile, self.args.totalratenum)
+        ts_name = "timestamp" if self.args.fullname else "ts"
+        for table, title in (('top_ops', 'highest_rates_per_operation_in_logfile:'),
+                             ('top_jobs', 'jobs_with_highest_rates_per_operation_in_logfile:')):
+            print(title)
+            for record in top_db.query(table, ops, since, until):
+                op_name = record[0] if self.args.fullname else self.op_keys_rev.get(record[0],
+                                                                                    record[0])
+                times = record[2]
+                if self.args.humantime:
+                    times = time.strftime("%a %d %b %Y %H-%M-%S +0000", time.localtime(times))
+                job_id = f', job_id: {record[3]}' if table == 'top_jobs' else ''
+                print(f'- {op_name + ":" : <10} {{rate: {str(record[1]) + "," : <10} '
+                      f'{ts_name}: {times}{job_id}}}')
+        print('...')
+        top_db.close()
+
     def print_total_ops_logged(self, total_ops_logged):
         '''
         print total highest ops ever in YAML
@@ -872,35 +3125,300 @@ class JobStatsParser:
     def init_worker(self):
         '''
         Gracefully handle CTRL-C (KeyboardInterrupt) in multiprocessing pool
+        and keep the parser of the worker process, so it is not pickled again
+        with every task
         '''
         signal.signal(signal.SIGINT, signal.SIG_IGN)
         #signal.signal(signal.SIGINT, signal.default_int_handler)
+        JobStatsParser.worker = self
 
 
-    def run_once_par(self, query_type): # pylint: disable=too-many-locals,too-many-branches
+    @staticmethod
+    def parse_worker(task):
         '''
-        scan/parse/aggregate/print top jobs in given job_stats pattern/path(s)
+        parse and aggregate a chunk of targets in a worker process, the
+        groupby settings are only known after the workers were started
+        '''
+        chunk, grouping = task
+        worker = JobStatsParser.worker
+        if grouping != (worker.jobid_separator, worker.jobid_var):
+            worker.jobid_separator, worker.jobid_var = grouping
+            worker.group_cache.clear()
+        return worker.aggregate_chunk(chunk)
+
+
+    def parse_compact(self, data):
+        '''
+        parse a single job_stats output. Without histograms only the samples
+        are needed, the raw bytes are parsed by the fast path straight into
+        CompactJobStats which is also cheap to pickle back.
+        '''
+        if not self.args.enablehist:
+            if isinstance(data, str):
+                data = data.encode('UTF-8')
+            return CompactJobStats.from_bytes(data, self.op_names)
+        if isinstance(data, bytes):
+            data = data.decode('UTF-8')
+        return self.parse_single_job_stats_beo(data)
+
+
+    def aggregate(self, data, reference=None):
+        '''
+        turn the job_stats of one target into a partial aggregate: the jobs
+        grouped by --groupby and summed up, hidden are the job_ids removed
+        by the filter. With histograms it is the jobs dict of merge_job.
+        With --rate/--dif the rates of the target against its reference
+        counters are aggregated instead and the counters are returned too,
+        they are the reference of the next query.
+        '''
+        if isinstance(data, (bytes, str)):
+            data = self.parse_compact(data)
+        elif not self.args.enablehist:
+            data = CompactJobStats.from_job_stats(data['job_stats'] or [], self.op_names)
+
+        if isinstance(data, CompactJobStats):
+            if not (self.args.rate or self.args.difference):
+                return data.grouped(self.group_jobid, self.keep_job), None
+            if reference is None:
+                reference = CompactJobStats([], [], array('q'), array('q'))
+            rates = CompactJobRates.from_counters(data, reference, self.args.rate)
+            return rates.grouped(self.group_jobid, self.keep_job), data
+
+        jobs = {}
+        timestamp_dict = {}
+        for job in data['job_stats'] or []:
+            self.merge_job(jobs, job, timestamp_dict)
+        return {"jobs": jobs, "timestamps": timestamp_dict,
+                "hidden": {job_id for job_id in jobs if not self.keep_job(job_id)}}, None
+
+
+    def timed_aggregate(self, target, data, reference=None):
+        '''
+        aggregate the job_stats of target, the time it took and the number
+        of jobs are returned for the metrics
+        '''
+        start = time.perf_counter()
+        partial, counters = self.aggregate(data, reference)
+        jobs = partial["jobs"] if isinstance(partial, dict) else partial
+        return target, partial, counters, {"parse_seconds": time.perf_counter() - start,
+                                           "jobs": len(jobs)}
+
+
+    def chunk_targets(self, statsdata, chunk_size):
+        '''
+        split the (target, data) pairs into chunks of at most chunk_size
+        targets of the same host, as (target, data, reference) tasks
+        '''
+        hosts = {}
+        for target, data in statsdata:
+            hosts.setdefault(target.rpartition(':')[0], []).append(
+                (target, data, self.target_counters.get(target)))
+        return [tasks[start:start + chunk_size] for tasks in hosts.values()
+                for start in range(0, len(tasks), chunk_size)]
+
+
+    def aggregate_chunk(self, chunk):
+        '''
+        aggregate the targets of a chunk and merge them into one partial
+        aggregate, so only that goes back from a worker process. Returns
+        the host, the partial and the (target, counters, stats) of every
+        target.
+        '''
+        results = [self.timed_aggregate(*task) for task in chunk]
+        return (chunk[0][0].rpartition(':')[0],
+                self.reduce_partials([result[1] for result in results]),
+                [(target, counters, stats) for target, _, counters, stats in results])
+
+
+    def fill_missing(self, results):
+        '''
+        chunk results of the last query for the missing hosts, so their
+        jobs do not drop out of the rates and the next rates of them are
+        taken against their last counters, for at most --keep_missing
+        queries in a row
+        '''
+        for host in set(self.missed_queries) - self.missing_hosts:
+            del self.missed_queries[host]
+        for host in self.missing_hosts:
+            self.missed_queries[host] += 1
+
+        answered = {result[0] for result in results}
+        kept = [result for result in self.last_results if result[0] not in answered and
+                0 < self.missed_queries[result[0]] <= self.args.keep_missing]
+        self.last_results = results + kept
+        return kept
+
+
+    def merge_partials(self, partial, other):
+        '''
+        merge two partial aggregates into a new one, the jobs of partial come
+        first. Neither of them is changed, fill_missing may keep them.
+        '''
+        if isinstance(partial, CompactJobStats):
+            return partial.merge(other)
+
+        jobs = {jobid: dict(job) for jobid, job in partial["jobs"].items()}
+        timestamp_dict = {jobid: dict(stamps) for jobid, stamps in partial["timestamps"].items()}
+        for jobid, job in other["jobs"].items():
+            job2 = jobs.get(jobid, {})
+            for key, value in job.items():
+                if key in ['read_bytes', 'write_bytes']:
+                    job2[key] = list(map(add, job2.get(key, [0, Counter({})]), value))
+                elif key != 'job_id':
+                    job2[key] = job2.get(key, 0) + value
+            job2['job_id'] = jobid
+            jobs[jobid] = job2
+            stamps = timestamp_dict.setdefault(jobid, {})
+            for key, value in other["timestamps"][jobid].items():
+                stamps[key] = max(stamps.get(key, value), value)
+        return {"jobs": jobs, "timestamps": timestamp_dict,
+                "hidden": partial["hidden"] | other["hidden"]}
+
+
+    def reduce_partials(self, partials):
+        '''
+        merge the partial aggregates pairwise, level by level
+        '''
+        if not partials:
+            if self.args.enablehist:
+                return {"jobs": {}, "timestamps": {}, "hidden": set()}
+            if self.args.rate or self.args.difference:
+                return CompactJobRates([], [], array('q'), array('d'), array('b'), array('q'))
+            return CompactJobStats([], [], array('q'), array('q'))
+
+        while len(partials) > 1:
+            pairs = zip(partials[0::2], partials[1::2])
+            merged = [self.merge_partials(*pair) for pair in pairs]
+            partials = merged + partials[2 * len(merged):]
+        return partials[0]
+
+
+    def partial_jobs(self, partial):
+        '''
+        jobs and timestamp dicts of the dict engine from a partial aggregate,
+        the job_ids are the interned ones of the job table
         '''
+        if not isinstance(partial, CompactJobStats):
+            return partial["jobs"], partial["timestamps"]
+
         jobs = {}
         timestamp_dict = {}
+        ops = partial.ops
+        width = len(ops)
+        self.trim_job_table()
+        job_ids = self.job_table.intern(partial.job_ids)
+        for i, jobid in enumerate(job_ids):
+            job2 = {}
+            for col, value in enumerate(partial.samples[width * i:width * (i + 1)]):
+                if value:
+                    job2[ops[col]] = value
+                    job2['ops'] = job2.get('ops', 0) + value
+            job2['job_id'] = jobid
+            jobs[jobid] = job2
+            timestamp_dict[jobid] = {key: partial.times[3 * i + j] for j, key in
+                                     enumerate(CompactJobStats.time_keys)
+                                     if partial.times[3 * i + j] != -1}
+        return jobs, timestamp_dict
+
+
+    def partial_rates(self, partial):
+        '''
+        rate jobs and sampling windows of the dict engine from the partial
+        aggregate of the rates, like rate_calc returns them
+        '''
+        jobs = {}
+        job_sampling_window = {}
+        ops = partial.ops
+        width = len(ops)
+        self.trim_job_table()
+        job_ids = self.job_table.intern(partial.job_ids)
+        for i, jobid in enumerate(job_ids):
+            job2 = {}
+            for col, present in enumerate(partial.present[width * i:width * (i + 1)]):
+                if present:
+                    value = partial.samples[width * i + col]
+                    job2[ops[col]] = round(value)
+                    job2['ops'] = job2.get('ops', 0) + value
+            if 'ops' in job2:
+                job2['ops'] = round(job2['ops'])
+            job2['job_id'] = jobid
+            jobs[jobid] = job2
+            job_sampling_window[jobid] = partial.windows[i]
+        return jobs, job_sampling_window
+
+
+    def trim_job_table(self):
+        '''
+        start over with a new job table once too many jobs came and went
+        '''
+        if len(self.job_table) > self.job_table.max_size:
+            self.job_table = JobIdTable()
+
+
+    def parse_inline(self, statsdata):
+        '''
+        Decide if handing the data to the parser processes costs more than
+        parsing it right away in the main process
+        '''
+        if self.args.num_proc_data <= 1 or len(statsdata) <= 1:
+            return True
+        return sum(len(data) for data in statsdata) < self.args.inline_parse_bytes
+
+
+    def run_once_par(self, query_type): # pylint: disable=too-many-locals,too-many-branches
+        '''
+        scan/parse/aggregate/print top jobs in given job_stats pattern/path(s)
+        '''
         query_time = int(time.time())
+        self.metrics.start(query_time)
 
         if self.args.verb:
             ssh_start = time.time()
 
-        statsdata = self.get_data(query_type)
+        self.transfer_stats = {}
+        self.missing_hosts = set()
+        if self.ssh_pool:
+            self.ssh_pool.pop_connect_times()
+        if self.args.replay:
+            query_time, statsdata = self.replay_next()
+            self.metrics.set(query_time=query_time)
+        else:
+            statsdata = self.get_data(query_type)
+        self.metrics.lap('collect')
+        if self.args.record:
+            self.captures.write(query_time, statsdata)
+            self.metrics.lap('record')
 
         if self.args.verb:
             ssh_stop = time.time()
             ssh_time = ssh_stop - ssh_start
             parser_start = time.time()
 
+        self.hidden_jobs = None
         try:
-            with Pool(processes=self.args.num_proc_data,
-                    initializer=self.init_worker) as proc_pool:
-                objs = list(proc_pool.imap_unordered(func=self.parse_single_job_stats_beo,
-                                                    iterable=statsdata,
-                                                    chunksize=self.args.num_chunk_data))
+            if self.args.stream or self.args.agent or self.parse_inline(statsdata):
+                results = [self.aggregate_chunk(chunk) for chunk in
+                           self.chunk_targets(statsdata, max(len(statsdata), 1))]
+            else:
+                # about one chunk per parser process, each merges its chunk
+                chunk_size = max(self.args.num_chunk_data,
+                                 -(-len(statsdata) // self.args.num_proc_data))
+                grouping = (self.jobid_separator, self.jobid_var)
+                results = list(self.parse_pool.imap_unordered(
+                    func=self.parse_worker,
+                    iterable=[(chunk, grouping) for chunk in
+                              self.chunk_targets(statsdata, chunk_size)]))
+            self.metrics.lap('parse')
+            partial = self.reduce_partials([result[1] for result in
+                                            results + self.fill_missing(results)])
+            self.metrics.lap('reduce')
+            if isinstance(partial, CompactJobRates):
+                self.target_counters = {target: counters for _, _, targets in self.last_results
+                                        for target, counters, _ in targets}
+            if isinstance(partial, CompactJobStats):
+                self.hidden_jobs = partial.hidden
+            else:
+                self.hidden_jobs = partial["hidden"]
 
         except KeyboardInterrupt:
             if self.args.verb:
@@ -908,6 +3426,16 @@ class JobStatsParser:
             print()
             sys.exit()
 
+        self.metrics.hosts(self.transfer_stats,
+                           self.ssh_pool.pop_connect_times() if self.ssh_pool else {},
+                           self.missing_hosts)
+        for target, data in statsdata:
+            if isinstance(data, (bytes, str)):
+                self.metrics.target(target, bytes=len(data))
+        for _, _, targets in results:
+            for target, _, stats in targets:
+                self.metrics.target(target, **stats)
+
         if self.args.verb:
             parser_stop = time.time()
             parser_time = parser_stop - parser_start
@@ -915,31 +3443,54 @@ class JobStatsParser:
             print(f"SSH time         : {ssh_time}")
             print(f"Parser time      : {parser_time}")
             print(f"Loop time        : {loop_time}")
+            for host, (wire_bytes, raw_bytes, *_) in sorted(self.transfer_stats.items()):
+                print(f"Bytes {host: <11}: {wire_bytes} received, {raw_bytes} "
+                      f"uncompressed ({raw_bytes / max(wire_bytes, 1):.1f}x)")
+
+        if self.args.engine == 'numpy':
+            self.run_once_matrix(partial, query_time)
+            return
+
+        if isinstance(partial, CompactJobRates):
+            jobs, job_sampling_window = self.partial_rates(partial)
+            total_jobs = len(jobs)
+            query_duration = query_time - (self.reference_time or query_time)
+            first_query = self.reference_time is None
+            self.reference_time = query_time
+        else:
+            jobs, timestamp_dict = self.partial_jobs(partial)
+            total_jobs = len(set(jobs))
 
-        for obj in objs:
-            if obj['job_stats'] is None:
-                continue
-
-            for job in obj['job_stats']:
-                self.merge_job(jobs, job, timestamp_dict)
-
-        total_jobs = len(set(jobs))
-
-        if (self.args.rate or self.args.difference) and not self.reference:
-            jobs, job_sampling_window, query_duration = self.rate_calc(jobs,
-                                                                        query_time,
-                                                                        timestamp_dict)
-        elif (self.args.rate or self.args.difference) and self.reference:
+        if (self.args.rate or self.args.difference) and not isinstance(partial, CompactJobRates):
+            # histograms, the rates are taken from the jobs summed over all targets
+            first_query = not self.reference
             jobs, job_sampling_window, query_duration = self.rate_calc(jobs,
                                                                         query_time,
                                                                         timestamp_dict)
+        self.metrics.lap('jobs')
+        self.metrics.set(jobs=total_jobs)
+
+        if self.args.rate or self.args.difference:
+            if first_query:
+                return
+            if self.args.historyfile:
+                self.record_history(jobs, job_sampling_window, query_time)
+                self.metrics.lap('history')
             if self.args.total or self.args.percent or self.args.totalrate:
                 total_ops = self.total_calc(jobs)
+                self.metrics.lap('totals')
             if self.args.totalrate and self.args.total:
                 top_ops_ever = self.topdb(total_ops, jobs, query_time)
+                self.metrics.lap('topdb')
+            if self.server:
+                self.publish(jobs, total_jobs, query_time, query_duration)
+                self.metrics.lap('serve')
+                return
             if self.args.percent:
                 jobs = self.pct_calc(jobs, total_ops)
+                self.metrics.lap('percent')
             top_jobs = self.pick_top_jobs(jobs, self.args.count)
+            self.metrics.lap('topk')
             self.print_top_jobs(top_jobs,
                                 total_jobs,
                                 self.args.count,
@@ -953,12 +3504,101 @@ class JobStatsParser:
         else:
             if self.args.total or self.args.percent:
                 total_ops = self.total_calc(jobs)
+                self.metrics.lap('totals')
             if self.args.percent:
                 jobs = self.pct_calc(jobs, total_ops)
+                self.metrics.lap('percent')
             top_jobs = self.pick_top_jobs(jobs, self.args.count)
+            self.metrics.lap('topk')
             self.print_top_jobs(top_jobs, total_jobs, self.args.count, 0, query_time, 0)
             if self.args.total:
                 self.print_total_ops(total_ops)
+        self.metrics.lap('print')
+
+
+    def run_once_matrix(self, partial, query_time): # pylint: disable=too-many-branches
+        '''
+        aggregate/print top jobs with all jobs kept in a JobMatrix, the output
+        is the same as with the dict engine
+        '''
+        self.trim_job_table()
+        jobs = JobMatrix.from_job_stats(list(self.op_keys.values()), [partial],
+                                        table=self.job_table)
+        total_jobs = len(jobs)
+        job_sampling_window = 0
+        query_duration = 0
+        top_ops_ever = None
+        self.metrics.lap('jobs')
+        self.metrics.set(jobs=total_jobs)
+
+        if self.args.rate or self.args.difference:
+            if self.reference_time is None:
+                self.reference_time = query_time
+                return
+            query_duration = query_time - self.reference_time
+            self.reference_time = query_time
+            job_sampling_window = dict(zip(jobs.job_ids, jobs.windows.tolist()))
+            if self.args.historyfile:
+                self.record_history(jobs, job_sampling_window, query_time)
+                self.metrics.lap('history')
+
+        if self.args.total or self.args.percent or self.args.totalrate:
+            total_ops = jobs.totals()
+            self.metrics.lap('totals')
+        if self.args.totalrate and self.args.total:
+            top_ops_ever = self.topdb(total_ops,
+                                      {jobs.job_ids[row]: jobs.job_dict(row)
+                                       for row in jobs.top_per_op(self.args.totalratenum)},
+                                      query_time)
+            self.metrics.lap('topdb')
+        if self.server:
+            self.publish(jobs, total_jobs, query_time, query_duration)
+            self.metrics.lap('serve')
+            return
+        if self.args.percent:
+            jobs = jobs.percent(total_ops)
+            self.metrics.lap('percent')
+
+        top_jobs = [jobs.job_dict(row) for row in jobs.top_rows(self.args.count,
+                                                                self.sort_keys,
+                                                                self.args.minrate,
+                                                                self.keep_job)]
+        self.metrics.lap('topk')
+        self.print_top_jobs(top_jobs,
+                            total_jobs,
+                            self.args.count,
+                            job_sampling_window,
+                            query_time,
+                            query_duration)
+        if self.args.total:
+            self.print_total_ops(total_ops)
+        if self.args.totalrate and top_ops_ever:
+            self.print_total_ops_logged(top_ops_ever)
+        self.metrics.lap('print')
+
+
+    def publish(self, jobs, total_jobs, query_time, query_duration):
+        '''
+        hand the jobs of the query to the --serve HTTP server, the top jobs
+        are picked in its request threads, so nothing they use may change
+        with the next query
+        '''
+        if isinstance(jobs, JobMatrix):
+            hidden = self.hidden_jobs
+            keep = self.keep_job if hidden is None else lambda job_id: job_id not in hidden
+            minrate = self.args.minrate
+
+            def top(count, sort_keys):
+                return [jobs.job_dict(row) for row in jobs.top_rows(count, sort_keys,
+                                                                    minrate, keep)]
+            totals = jobs.totals()
+        else:
+            candidates = [job for job in jobs.values() if self.top_candidate(job)]
+
+            def top(count, sort_keys):
+                return self.sort_top_jobs(candidates, count, sort_keys)
+            totals = self.total_calc(jobs)
+        self.server.publish(query_time, query_duration, total_jobs, totals, top)
 
 
     def run_once_retry(self, query_type): #pylint: disable=inconsistent-return-statements
@@ -966,6 +3606,9 @@ class JobStatsParser:
         Call run_once. If run_once succeeds, return.
         If run_once throws an exception, retry for few times.
         '''
+        if self.args.replay:
+            # a retry would go on with the next capture
+            return self.run_once_par(query_type)
         for i in range(2, -1, -1):  # 2, 1, 0
             try:
                 return self.run_once_par(query_type)
@@ -978,61 +3621,32 @@ class JobStatsParser:
         '''
         SSH to all servers and execute lctl command
         '''
-        host, query_type, cmd = arg_list
-
-        ssh = paramiko.SSHClient()
-        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        host, query_type, cmd = arg_list[:3]
 
         try:
-            if self.argparser.password:
-                ssh.connect(hostname=host,
-                            username=self.argparser.user,
-                            password=self.argparser.password)
-
-            else:
-                if self.argparser.keytype in ["DSS", "DSA"]:
-                    ssh_pkey = paramiko.DSSKey.from_private_key_file(
-                        filename=self.argparser.key)
-
-                if self.argparser.keytype == "ECDSA":
-                    ssh_pkey = paramiko.ECDSAKey.from_private_key_file(
-                        filename=self.argparser.key)
-
-                if self.argparser.keytype == "RSA":
-                    ssh_pkey = paramiko.RSAKey.from_private_key_file(
-                        filename=self.argparser.key)
-
-                if self.argparser.keytype == "Ed25519":
-                    ssh_pkey = paramiko.Ed25519Key.from_private_key_file(
-                        filename=self.argparser.key)
-
-                try:
-                    ssh.connect(hostname=host,
-                                username=self.argparser.user,
-                                pkey=ssh_pkey)
-                except paramiko.ssh_exception.NoValidConnectionsError as exn:
-                    print(f'Exception in ssh.connect(hostname={host})\n', exn)
-                    raise
-
             try:
-                stdin, stdout, stderr = ssh.exec_command(cmd)
+                if self.args.stream and query_type in ["stats", "batch"]:
+                    return self.name_targets(host, arg_list[3],
+                                             self.ssh_get_stream(host, query_type, cmd))
+                output = b''.join(self.fetch(host, query_type, cmd))
             except Exception as exn: # pylint: disable=bare-except,broad-exception-caught
-                ssh.close()
                 if self.args.verb:
-                    print(f"Exception running ssh.exec_command({cmd})\n", exn)
-                    error = stderr.read().decode(encoding='UTF-8') # pylint: disable=used-before-assignment
-                    print(error)
-                    stdinput = stdin.read().decode(encoding='UTF-8') # pylint: disable=used-before-assignment
-                    print(stdinput)
+                    print(f"Exception running ssh.exec_command({cmd}) on {host}\n", exn)
                 raise
 
-            output = stdout.read().decode(encoding='UTF-8')
-
+            # job_stats are kept as raw bytes for the parser fast path
+            if query_type == "stats":
+                return self.name_targets(host, arg_list[3], [output])
+            if query_type == "batch":
+                return self.name_targets(host, arg_list[3], self.split_batch(output))
+            output = output.decode(encoding='UTF-8')
             if query_type == "param":
                 hostparam = (host, output.split())
                 return hostparam
-            if query_type == "stats":
+            if query_type == "value":
                 return output
+            if query_type == "agent":
+                return self.parse_agent_output(host, output)
 
         except KeyboardInterrupt:
             if self.args.verb:
@@ -1041,27 +3655,268 @@ class JobStatsParser:
             sys.exit()
 
 
+    @staticmethod
+    def name_targets(host, params, targets):
+        '''
+        pair the job_stats of every target with its name "host:param"
+        '''
+        return [(f'{host}:{param}', target) for param, target in zip(params, targets)]
+
+
+    def ssh_get_stream(self, host, query_type, cmd):
+        '''
+        Execute lctl command and parse the output while it arrives
+        '''
+        if query_type == "batch":
+            stream_parser = JobStatsStreamParser(self.parse_single_job_stats_beo,
+                                                 self.batch_marker)
+        else:
+            stream_parser = JobStatsStreamParser(self.parse_single_job_stats_beo)
+
+        for chunk in self.fetch(host, query_type, cmd):
+            stream_parser.feed(chunk)
+        return stream_parser.close()
+
+
+    def compress_codecs(self):
+        '''
+        Codecs to try on the OSS/MDS in order of preference, all of them
+        can be decompressed locally
+        '''
+        if self.args.compress == 'auto':
+            return [codec for codec in self.compress_cmds if codec != 'zstd' or zstandard]
+        return [self.args.compress]
+
+
+    def compress_cmd(self, cmd):
+        '''
+        Wrap cmd so its output is compressed with the first available codec,
+        the codec used is sent on the first line
+        '''
+        branches = []
+        for codec in self.compress_codecs():
+            tool = self.compress_cmds[codec]
+            branches.append(f'command -v {tool.split()[0]} >/dev/null 2>&1; then '
+                            f'echo {codec}; ({cmd}) | {tool}')
+        fallback = f'echo none; ({cmd})'
+        if not branches:
+            return fallback
+        return 'if ' + '; elif '.join(branches) + f'; else {fallback}; fi'
+
+
+    @staticmethod
+    def decompressor(codec):
+        '''
+        Return a streaming decompressor for codec
+        '''
+        if codec == 'gzip':
+            return zlib.decompressobj(wbits=31)
+        if codec == 'xz':
+            return lzma.LZMADecompressor()
+        if codec == 'zstd':
+            return zstandard.ZstdDecompressor().decompressobj()
+        return None
+
+
+    def fetch(self, host, query_type, cmd):
+        '''
+        Execute cmd on host and yield its (decompressed) output as it arrives,
+        the bytes received and returned and the run time are accounted per host
+        '''
+        if query_type not in ["stats", "batch", "agent"]:
+            yield from self.ssh_pool.exec_stream(host, cmd)
+            return
+
+        wire_bytes = raw_bytes = 0
+        first_byte = None
+        start = time.perf_counter()
+        decomp = None
+        if self.args.compress == 'none':
+            chunks = self.ssh_pool.exec_stream(host, cmd)
+        else:
+            chunks = self.ssh_pool.exec_stream(host, self.compress_cmd(cmd))
+            header = b''
+            for chunk in chunks:
+                if first_byte is None:
+                    first_byte = time.perf_counter() - start
+                wire_bytes += len(chunk)
+                header += chunk
+                if b'\n' in header:
+                    break
+            codec, _, rest = header.partition(b'\n')
+            decomp = self.decompressor(codec.decode())
+            chunks = itertools.chain([rest], chunks)
+
+        for chunk in chunks:
+            if first_byte is None:
+                first_byte = time.perf_counter() - start
+            wire_bytes += len(chunk)
+            if decomp:
+                chunk = decomp.decompress(chunk)
+            raw_bytes += len(chunk)
+            if chunk:
+                yield chunk
+
+        # channels to a host run concurrently, the longest one is kept
+        seconds = time.perf_counter() - start
+        with self.transfer_lock:
+            host_stats = self.transfer_stats.setdefault(host, [0, 0, 0, 0, 0])
+            host_stats[0] += wire_bytes
+            host_stats[1] += raw_bytes
+            host_stats[2] = max(host_stats[2], seconds)
+            host_stats[3] = max(host_stats[3], first_byte or seconds)
+            host_stats[4] += 1
+
+
+    def agent_cmd(self, host, params):
+        '''
+        Build the remote command running the agent helper for all params
+        '''
+        if self.args.agent_delta:
+            params = ['--delta', f'{self.delta_name}-{host}.json',
+                      str(self.delta_gen.get(host, 0))] + params
+        return ('$(command -v python3 || command -v python) -c '
+                f'{shlex.quote(self.agent_script)} {" ".join(shlex.quote(p) for p in params)}')
+
+
+    @staticmethod
+    def agent_jobs(target):
+        '''
+        Convert the compact job rows of one target into parsed job dicts
+        '''
+        ops = target["ops"]
+        for row in target["jobs"]:
+            job = {"job_id": row[0]}
+            for key, value in zip(("snapshot_time", "start_time", "elapsed_time"), row[1:4]):
+                if value is not None:
+                    job[key] = value
+            for i in range(4, len(row), 2):
+                job[ops[row[i]]] = {"samples": row[i + 1]}
+            yield job
+
+
+    def parse_agent_output(self, host, output):
+        '''
+        Convert the compact summaries of the agent helper into parsed
+        job_stats, one per target. Delta summaries are applied to the jobs
+        kept from the previous queries of host first.
+        '''
+        summary = json.loads(output)
+
+        if "gen" not in summary:
+            return [(f'{host}:{param}', {"job_stats": list(self.agent_jobs(target))})
+                    for param, target in summary["targets"].items()]
+
+        old_state = {} if summary["full"] else self.delta_state.get(host, {})
+        state = {}
+        for param, target in summary["targets"].items():
+            jobs = old_state.get(param, {})
+            for job_id in target["gone"]:
+                jobs.pop(job_id, None)
+            for job in self.agent_jobs(target):
+                jobs[job["job_id"]] = job
+            state[param] = jobs
+
+        self.delta_state[host] = state
+        self.delta_gen[host] = summary["gen"]
+        return [(f'{host}:{param}', {"job_stats": list(jobs.values())})
+                for param, jobs in state.items()]
+
+
+    def batch_cmd(self, params):
+        '''
+        Build a single remote command printing the job_stats of all params,
+        each one preceded by a delimiter line. The delimiter starts with a
+        newline, so it is a line of its own even if the output before it
+        does not end with one.
+        '''
+        return '; '.join(f"printf '\\n%s\\n' {shlex.quote(self.batch_marker + ' ' + param)}; "
+                         f'lctl get_param -n {shlex.quote(param)}' for param in params)
+
+
+    def split_batch(self, output):
+        '''
+        Split the output of a batched query back into one blob per target,
+        the newline printed before each delimiter is dropped with it
+        '''
+        marker = b'\n' + self.batch_marker.encode() + b' '
+        blobs = output.split(marker)[1:]
+        return [blob.partition(b'\n')[2] for blob in blobs]
+
+
+    def try_ssh_get(self, arg_list):
+        '''
+        ssh_get returning the exception instead of raising it, so a failing
+        server does not stop the query of the others
+        '''
+        try:
+            return arg_list, self.ssh_get(arg_list), None
+        except Exception as exn: # pylint: disable=bare-except,broad-exception-caught
+            return arg_list, None, exn
+
+
+    def collect(self, map_args):
+        '''
+        ssh_get for all map_args until the --tick_limit deadline, only the
+        failed ones are tried again, twice. The hosts without an answer are
+        kept in missing_hosts, their connections are dropped.
+        '''
+        results = []
+        failed = timed_out = []
+        for _ in range(3):
+            answered = set()
+            failed = []
+            for arg_list, result, exn in self.collector.run(self.try_ssh_get, map_args,
+                                                            self.collect_deadline):
+                answered.add(id(arg_list))
+                if exn is None:
+                    results.append(result)
+                else:
+                    failed.append(arg_list)
+                    if self.args.verb:
+                        print(f"Query of {arg_list[0]} failed: {exn!r}")
+            timed_out = [arg_list for arg_list in map_args if id(arg_list) not in answered]
+            for host in {arg_list[0] for arg_list in failed + timed_out}:
+                self.ssh_pool.drop(host)
+            if timed_out or not failed:
+                break
+            map_args = failed
+        self.missing_hosts = {arg_list[0] for arg_list in failed + timed_out}
+        return results
+
+
     def get_data(self, query_type):
         '''
-        Spawn SSH connections to each server in parallel to gather data
+        Query each server concurrently to gather data, job_stats are returned
+        as (target, job_stats) pairs
         '''
+        if self.local:
+            if query_type == "param":
+                return {self.local.host: self.local.list_param(self.args.param)}
+            return self.local.get_targets(self.hosts_param[self.local.host], self.args.verb)
+
         try:
-            with Pool(processes=self.args.num_proc_ssh,
-                    initializer=self.init_worker) as proc_pool:
-                if query_type == "param":
-                    map_args = [[host, query_type, f'lctl list_param {self.args.param}'] for
-                                host in self.argparser.serverlist]
-                    hostdata = dict(proc_pool.imap_unordered(func=self.ssh_get,
-                                                            iterable=map_args,
-                                                            chunksize=self.args.num_chunk_ssh))
-
-                if query_type == "stats":
-                    map_args = [[host, query_type, f'lctl get_param -n {param}'] for
-                                host in self.argparser.serverlist for
-                                param in self.hosts_param[host]]
-                    hostdata = list(proc_pool.imap_unordered(func=self.ssh_get,
-                                                            iterable=map_args,
-                                                            chunksize=self.args.num_chunk_ssh))
+            if query_type == "param":
+                map_args = [[host, query_type, f'lctl list_param {self.args.param}'] for
+                            host in self.argparser.serverlist]
+                hostdata = dict(self.collector.run(self.ssh_get, map_args))
+
+            if query_type == "stats" and self.args.agent:
+                map_args = [[host, "agent", self.agent_cmd(host, self.hosts_param[host])] for
+                            host in self.argparser.serverlist if self.hosts_param[host]]
+                hostdata = [target for targets in self.collect(map_args) for target in targets]
+
+            elif query_type == "stats" and self.args.batch:
+                map_args = [[host, "batch", self.batch_cmd(self.hosts_param[host]),
+                             self.hosts_param[host]] for
+                            host in self.argparser.serverlist if self.hosts_param[host]]
+                hostdata = [blob for blobs in self.collect(map_args) for blob in blobs]
+
+            elif query_type == "stats":
+                map_args = [[host, query_type, f'lctl get_param -n {param}', [param]] for
+                            host in self.argparser.serverlist for
+                            param in self.hosts_param[host]]
+                hostdata = [target for targets in self.collect(map_args) for target in targets]
 
         except KeyboardInterrupt:
             if self.args.verb:
@@ -1069,14 +3924,37 @@ class JobStatsParser:
             print()
             sys.exit()
         else:
+            self.ssh_pool.prune()
             return hostdata
 
-    def parsing_jobid_name(self):
+    def replay_next(self):
+        '''
+        next recorded query, paced to --replay_speed times the recorded speed
+        '''
+        query_time, statsdata = self.captures.next()
+        if self.args.replay_speed > 0:
+            if self.replay_start is None:
+                self.replay_start = (time.time(), query_time)
+            else:
+                due = (self.replay_start[0] +
+                       (query_time - self.replay_start[1]) / self.args.replay_speed)
+                time.sleep(max(due - time.time(), 0))
+        return query_time, statsdata
+
+    def parsing_jobid_name(self, jobid_name=None):
 
-        host = next(iter(self.argparser.serverlist))
-        arg_list = [host, "stats", "lctl get_param -n jobid_name"]
-        jobid_name = self.ssh_get(arg_list)
+        if jobid_name is None and self.local:
+            try:
+                jobid_name = self.local.get_param('jobid_name').decode()
+            except OSError as err:
+                print(f'Could not read jobid_name: {err}')
+                sys.exit()
+        if jobid_name is None:
+            host = next(iter(self.argparser.serverlist))
+            arg_list = [host, "value", "lctl get_param -n jobid_name"]
+            jobid_name = self.ssh_get(arg_list)
         jobid_name = jobid_name.strip()
+        self.jobid_name = jobid_name
         res = {}
         for opkey in self.jobid_name_keys:
             #print(self.jobid_name_keys[opkey])
@@ -1109,46 +3987,116 @@ class JobStatsParser:
         self.argparser = ArgParser()
         self.argparser.run()
         self.args = self.argparser.args
+        if self.args.command == 'query':
+            self.print_history_query()
+            return
+        if self.args.totalratequery:
+            self.print_topdb_query()
+            return
+        if self.args.local:
+            self.local = LocalStats(self.args.local)
+            self.argparser.serverlist = {self.local.host}
+        elif not self.args.replay:
+            self.ssh_pool = SSHConnectionPool(self.argparser, self.args.max_idle_ssh)
+        self.metrics = TickMetrics(self.args.metrics, self.args.metrics_format)
+        self.collector = CollectionEngine(self.args.num_proc_ssh, self.args.num_chunk_ssh)
         
         if not self.args.enablehist:
             self.op_keys.pop("rb")
             self.op_keys.pop("wb")
             self.op_keys_rev.pop("read_bytes")
             self.op_keys_rev.pop("write_bytes")
+        self.op_names = set(self.op_keys.values())
 
-        self.hosts_param = self.get_data("param")
+        # fork the parser processes once, before any SSH connection is opened
+        if not (self.args.stream or self.args.agent):
+            self.parse_pool = Pool(processes=self.args.num_proc_data,
+                                   initializer=self.init_worker)
+
+        if self.args.serve:
+            try:
+                self.server = JobStatsServer(JobStatsServer.address(self.args.serve), self)
+            except (OSError, ValueError) as err:
+                print(f'Could not serve on {self.args.serve}: {err}')
+                sys.exit()
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        meta = {}
+        if self.args.replay:
+            self.captures = CaptureDir(self.args.replay)
+            meta = self.captures.read_meta()
+            self.argparser.serverlist = set(meta["servers"])
+            self.hosts_param = meta["hosts_param"]
+        else:
+            self.hosts_param = self.get_data("param")
         self.osts_mdts = Counter([item.split('.')[0] for
                         sublist in self.hosts_param.values() for
                         item in sublist])
         if self.args.verb:
             total_time_start = time.time()
 
-        self.parsing_jobid_name()   
+        self.parsing_jobid_name(meta.get("jobid_name"))
 
-        if self.args.sortby not in self.op_keys_rev:
-            print("sortby argument key " + self.args.sortby + " is not in ops key list")
-            print("ops key list:")
-            print(self.op_keys_rev.keys())
-            sys.exit()   
+        if self.args.record:
+            self.captures = CaptureDir(self.args.record, create=True)
+            self.captures.write_meta({"servers": sorted(self.argparser.serverlist),
+                                      "hosts_param": self.hosts_param,
+                                      "jobid_name": self.jobid_name})
 
+        self.sort_keys = self.parse_sortby(self.args.sortby)
+
+        scheduler = TickScheduler(self.args.interval)
         i = 0
         try:
             while True:
+                scheduler.start()
+                self.collect_deadline = scheduler.deadline(self.args.tick_limit)
                 self.run_once_retry("stats")
+                if self.missing_hosts:
+                    scheduler.partial += 1
                 i += 1
+                if self.args.replay:
+                    self.metrics.write()
+                    if self.captures.done() or i == self.args.repeats:
+                        break
+                    continue
+                missed = scheduler.finish()
+                if missed:
+                    # not on stdout, it would end up between the YAML documents
+                    print(f"Query took {time.time() - scheduler.tick_start:.1f}s, "
+                          f"{missed} of the {self.args.interval}s interval starts skipped",
+                          file=sys.stderr)
+                self.metrics.set(skipped_ticks=missed)
+                self.metrics.write()
                 if self.args.repeats != -1 and i >= self.args.repeats:
                     break
-                time.sleep(self.args.interval)
+                scheduler.sleep()
         except KeyboardInterrupt:
             if self.args.verb:
                 print("Caught KeyboardInterrupt in Run(), terminating")
             print()
             sys.exit()
+        finally:
+            if self.ssh_pool:
+                self.ssh_pool.close()
+            self.collector.close()
+            if self.parse_pool:
+                self.parse_pool.terminate()
+            if self.top_db:
+                self.top_db.close()
+            if self.history:
+                self.history.close()
+            if self.server:
+                self.server.shutdown()
+                self.server.server_close()
 
         if self.args.verb:
             total_time_stop = time.time()
             total_time = total_time_stop - total_time_start
             print(f"Total runtime    : {total_time}")
+            print(f"Overruns         : {scheduler.overruns} of {scheduler.ticks} queries, "
+                  f"{scheduler.skipped} starts skipped, longest {scheduler.max_overrun:.1f}s "
+                  f"past the next start, {scheduler.partial} queries with missing servers")
 
 if __name__ == "__main__":
     try:
@@ -0,0 +1,505 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+-----------------------------------------------------------------------------
+glljobstat_bench.py - benchmarks for the stages of glljobstat.py
+-----------------------------------------------------------------------------
+
+Run the stages of glljobstat.py on captured job_stats, e.g. taken with
+"lctl get_param -n obdfilter.*.job_stats > oss01.job_stats" on a busy server,
+and compare the implementations against each other. Synthetic job_stats of
+any size are made by the gen subcommand, the stages subcommand times each
+stage of a query on them and keeps the results to compare commits.
+'''
+
+import io
+import sys
+import gzip
+import json
+import lzma
+import time
+import argparse
+import platform
+import contextlib
+import subprocess
+from pathlib import Path
+from collections import Counter
+from glljobstat import (JobStatsParser, CompactJobStats, CompactJobRates, CaptureDir,
+                        ArgParser, JobFilter, JobIdTable, JobMatrix, np)
+
+
+class BenchArgParser: # pylint: disable=too-few-public-methods
+    '''
+    Class to define the benchmark subcommands and options
+    '''
+    def __init__(self):
+        self.parser = argparse.ArgumentParser(prog='glljobstat_bench.py',
+                                              description='Benchmark glljobstat.py stages')
+        subparsers = self.parser.add_subparsers(dest='bench', required=True)
+
+        parser = subparsers.add_parser('parser', help='full parser vs samples-only '
+                                                      'fast parser on job_stats captures')
+        parser.add_argument('captures', nargs='+', metavar='CAPTURE',
+                            help='job_stats capture file, .gz and .xz are decompressed')
+        parser.add_argument('-r', '--rounds', type=int, default=3,
+                            help='best of this many rounds is reported, default: 3')
+
+        gen = subparsers.add_parser('gen', help='write synthetic job_stats, as capture '
+                                                'directory for --replay or as raw files')
+        gen.add_argument('output', metavar='DIR', help='directory to write to')
+        self.add_generator_args(gen)
+        gen.add_argument('-tk', '--ticks', type=int, default=3,
+                         help='number of queries written as captures, default: 3')
+        gen.add_argument('-i', '--interval', type=int, default=10,
+                         help='seconds between two queries, default: 10')
+        gen.add_argument('--raw', action='store_true',
+                         help='write one raw job_stats file per target instead of captures')
+
+        stages = subparsers.add_parser('stages', help='time parsing, merging, rate '
+                                                      'calculation, top-k and printing')
+        stages.add_argument('-j', '--jobs', default='1000,10000,100000',
+                            help='comma separated numbers of jobs, default: 1000,10000,100000')
+        self.add_generator_args(stages, jobs=False)
+        stages.add_argument('-r', '--rounds', type=int, default=3,
+                            help='best of this many rounds is reported, default: 3')
+        stages.add_argument('-c', '--count', type=int, default=5,
+                            help='number of top jobs, default: 5')
+        stages.add_argument('-s', '--stages', default=','.join(StageBench.stages),
+                            help=f'comma separated stages to time out of '
+                                 f'{",".join(StageBench.stages + StageBench.extra_stages)}, '
+                                 f'default: {",".join(StageBench.stages)}')
+        stages.add_argument('--save', metavar='FILE',
+                            help='append the results as one JSON line to FILE')
+        stages.add_argument('--compare', metavar='FILE',
+                            help='compare with the last results saved in FILE')
+
+    @staticmethod
+    def add_generator_args(parser, jobs=True):
+        '''
+        options of the synthetic job_stats
+        '''
+        if jobs:
+            parser.add_argument('-j', '--jobs', type=int, default=10000,
+                                help='number of jobs, default: 10000')
+        parser.add_argument('-t', '--targets', type=int, default=8,
+                            help='number of targets, default: 8')
+        parser.add_argument('-m', '--mdts', type=int, default=1,
+                            help='how many of the targets are MDTs, default: 1')
+        parser.add_argument('-sp', '--spread', type=int, default=2,
+                            help='number of targets each job shows up on, default: 2')
+        parser.add_argument('-o', '--ops', type=int, default=0,
+                            help='only the first OPS operations of each target, default: all')
+        parser.add_argument('-l', '--lustre', choices=['2.12', '2.15'], default='2.15',
+                            help='job_stats format, 2.15 has secs.nsecs times, start_time, '
+                                 'elapsed_time and histograms, default: 2.15')
+        parser.add_argument('--no-hist', dest='hist', action='store_false',
+                            help='no read_bytes/write_bytes histograms in the 2.15 format')
+
+    def parse(self, argv=None):
+        '''
+        parse the command line
+        '''
+        return self.parser.parse_args(argv)
+
+
+class JobStatsGenerator:
+    '''
+    Class to generate job_stats of MDTs and OSTs like lctl get_param prints
+    them. Every job shows up on spread targets and uses about two thirds
+    of the operations, every 101st job is a heavy one. The counters only
+    grow from one tick to the next, so rates can be calculated.
+    '''
+    mdt_ops = ('open', 'close', 'mknod', 'link', 'unlink', 'mkdir', 'rmdir', 'rename',
+               'getattr', 'setattr', 'getxattr', 'setxattr', 'statfs', 'sync',
+               'samedir_rename', 'parallel_rename_file', 'parallel_rename_dir',
+               'crossdir_rename', 'read', 'write', 'punch', 'migrate', 'fallocate')
+    ost_ops = ('read_bytes', 'write_bytes', 'read', 'write', 'getattr', 'setattr', 'punch',
+               'sync', 'destroy', 'create', 'statfs', 'get_info', 'set_info', 'quotactl',
+               'prealloc')
+    jobid_name = '%j@%u@%H'
+    start = 1700000000
+
+    def __init__(self, args):
+        self.jobs = args.jobs
+        self.targets = max(args.targets, 1)
+        self.mdts = min(args.mdts, self.targets)
+        self.spread = min(max(args.spread, 1), self.targets)
+        self.num_ops = args.ops
+        self.lustre = args.lustre
+        self.hist = args.hist and args.lustre == '2.15'
+
+    def target_names(self):
+        '''
+        (host, param) of every target, one MDS and OSSs with 4 OSTs each
+        '''
+        names = [('mds00', f'mdt.fs-MDT{index:04x}.job_stats') for index in range(self.mdts)]
+        names += [(f'oss{index // 4:02d}', f'obdfilter.fs-OST{index:04x}.job_stats')
+                  for index in range(self.targets - self.mdts)]
+        return names
+
+    @staticmethod
+    def job_id(job):
+        '''
+        job_id of job number job in the jobid_name format
+        '''
+        return f'{10000000 + job}@{1000 + job % 500}@node{job % 4096:04d}'
+
+    def counter(self, job, col, target, tick):
+        '''
+        samples of one operation of a job, 0 for the unused ones
+        '''
+        mixed = ((job * 2654435761) ^ (col * 40503) ^ (target * 97)) & 0xffffffff
+        if not mixed % 3:
+            return 0
+        heavy = 1000 if job % 101 == 0 else 1
+        return (1 + mixed % 977) * heavy * (tick + 1)
+
+    def stat_line(self, op, samples):
+        '''
+        the line of one operation of a job
+        '''
+        if self.lustre == '2.12':
+            if op in ('read_bytes', 'write_bytes'):
+                return (f'  {op + ":":<16} {{ samples: {samples:>11}, unit: bytes, min: '
+                        f'{4096 if samples else 0:>8}, max: {1048576 if samples else 0:>8}, '
+                        f'sum: {samples * 65536:>14} }}')
+            return f'  {op + ":":<16} {{ samples: {samples:>11}, unit: reqs }}'
+        unit = 'bytes' if op in ('read_bytes', 'write_bytes') else 'usecs'
+        line = (f'  {op + ":":<16} {{ samples: {samples:>11}, unit: {unit}, min: '
+                f'{7 if samples else 0:>8}, max: {9000 if samples else 0:>8}, sum: '
+                f'{samples * 53:>14}, sumsq: {samples * 4021:>18}')
+        if unit == 'bytes' and self.hist:
+            if samples:
+                return line + f', hist: {{ 4K: {samples // 4}, 64K: {samples // 4}, ' \
+                              f'1M: {samples - samples // 4 * 2} }} }}'
+            return line + ', hist: { } }'
+        return line + ' }'
+
+    def target_stats(self, target, tick, query_time):
+        '''
+        job_stats of target number target at query number tick, as bytes
+        '''
+        ops = self.mdt_ops if target < self.mdts else self.ost_ops
+        ops = ops[:self.num_ops] if self.num_ops else ops
+        lines = ['job_stats:']
+        for shift in range(self.spread):
+            for job in range((target - shift) % self.targets, self.jobs, self.targets):
+                snapshot = query_time - job % 5
+                started = self.start - 3600 - job % 1000
+                lines.append(f'- job_id:          {self.job_id(job)}')
+                if self.lustre == '2.12':
+                    lines.append(f'  snapshot_time:   {snapshot}')
+                else:
+                    nsecs = job * 7919 % 1000000000
+                    lines.append(f'  snapshot_time:   {snapshot}.{nsecs:09d} secs.nsecs')
+                    lines.append(f'  start_time:      {started}.{nsecs:09d} secs.nsecs')
+                    lines.append(f'  elapsed_time:    {snapshot - started}.000000000 secs.nsecs')
+                for col, op in enumerate(ops):
+                    lines.append(self.stat_line(op, self.counter(job, col, target, tick)))
+        return ('\n'.join(lines) + '\n').encode()
+
+    def query(self, tick, interval=10):
+        '''
+        query time and (target, job_stats) pairs of query number tick
+        '''
+        query_time = self.start + tick * interval
+        return query_time, [(f'{host}:{param}', self.target_stats(target, tick, query_time))
+                            for target, (host, param) in enumerate(self.target_names())]
+
+    def write(self, output, ticks, interval, raw):
+        '''
+        write raw job_stats files or a capture directory for --replay
+        '''
+        if raw:
+            Path(output).mkdir(parents=True, exist_ok=True)
+            for target, (host, param) in enumerate(self.target_names()):
+                with open(Path(output) / f'{host}.{param}', 'wb') as statf:
+                    statf.write(self.target_stats(target, 0, self.start))
+            return
+        captures = CaptureDir(output, create=True)
+        hosts_param = {}
+        for host, param in self.target_names():
+            hosts_param.setdefault(host, []).append(param)
+        captures.write_meta({"servers": sorted(hosts_param), "hosts_param": hosts_param,
+                             "jobid_name": self.jobid_name})
+        for tick in range(ticks):
+            captures.write(*self.query(tick, interval))
+
+
+class StageBench:
+    '''
+    Class to time the stages of a query with the dict engine: parsing the
+    job_stats, merging the targets, rate calculation, top-k selection and
+    printing, plus top-k with the NumPy engine
+    '''
+    stages = ('parse', 'merge', 'rate', 'topk', 'topk_matrix', 'print')
+    extra_stages = ('parse_full',)
+
+    def __init__(self, args):
+        self.args = args
+        self.selected = args.stages.split(',')
+        unknown = set(self.selected) - set(self.stages + self.extra_stages)
+        if unknown:
+            print(f'Unknown stages {", ".join(sorted(unknown))}')
+            sys.exit(1)
+        if np is None and 'topk_matrix' in self.selected:
+            self.selected.remove('topk_matrix')
+        self.results = []
+        self.parser = self.stats_parser()
+
+    def stats_parser(self):
+        '''
+        JobStatsParser set up like Run() does for "-r -t -c count"
+        '''
+        parser = JobStatsParser()
+        parser.argparser = ArgParser()
+        parser.argparser.filter = JobFilter([])
+        parser.argparser.jobid_length = 17
+        parser.argparser.serverlist = set()
+        parser.args = ArgParser.parser().parse_args(['-r', '-t', '-c', str(self.args.count)])
+        for short, name in (('rb', 'read_bytes'), ('wb', 'write_bytes')):
+            parser.op_keys.pop(short, None)
+            parser.op_keys_rev.pop(name, None)
+        parser.op_names = set(parser.op_keys.values())
+        parser.sort_keys = parser.parse_sortby(parser.args.sortby)
+        parser.jobid_separator = '@'
+        parser.jobid_var = {'job': 0, 'user': 1, 'host': 2}
+        return parser
+
+    def time(self, jobs, stage, func, *args):
+        '''
+        run func, keep the best time of all rounds if stage is selected
+        '''
+        if stage not in self.selected:
+            return func(*args)
+        best = None
+        for _ in range(max(self.args.rounds, 1)):
+            start = time.perf_counter()
+            result = func(*args)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        self.results.append({"jobs": jobs, "stage": stage, "seconds": best})
+        print(f'{jobs:>9} {stage:<12} {best:>10.4f}', flush=True)
+        return result
+
+    def parse(self, datas):
+        '''
+        samples-only parsing of every target
+        '''
+        return [CompactJobStats.from_bytes(data, self.parser.op_names) for _, data in datas]
+
+    def parse_full(self, datas):
+        '''
+        full parsing of every target, as with --hist
+        '''
+        return [self.parser.parse_single_job_stats_beo(data.decode()) for _, data in datas]
+
+    def merge(self, compacts):
+        '''
+        group, reduce and turn the targets into the job dicts of the dict engine
+        '''
+        parser = self.parser
+        partial = parser.reduce_partials([compact.grouped(parser.group_jobid, parser.keep_job)
+                                          for compact in compacts])
+        return partial, parser.partial_jobs(partial)[0]
+
+    def rate(self, compacts, references):
+        '''
+        per target rates against the previous query, reduced to job dicts
+        '''
+        parser = self.parser
+        partial = parser.reduce_partials([
+            CompactJobRates.from_counters(new, ref, True).grouped(parser.group_jobid,
+                                                                  parser.keep_job)
+            for new, ref in zip(compacts, references)])
+        return parser.partial_rates(partial)
+
+    def topk_matrix(self, partial):
+        '''
+        build the JobMatrix and select the top jobs with the NumPy engine
+        '''
+        parser = self.parser
+        matrix = JobMatrix.from_job_stats(list(parser.op_keys.values()), [partial],
+                                          table=JobIdTable())
+        return matrix.top_rows(self.args.count, parser.sort_keys, parser.args.minrate,
+                               parser.keep_job)
+
+    def print_stage(self, jobs, windows, query_time):
+        '''
+        totals and the YAML output of the top jobs, written to memory
+        '''
+        parser = self.parser
+        with contextlib.redirect_stdout(io.StringIO()):
+            total_ops = parser.total_calc(jobs)
+            top_jobs = parser.pick_top_jobs(jobs, self.args.count)
+            parser.print_top_jobs(top_jobs, len(jobs), self.args.count, windows,
+                                  query_time, 10)
+            parser.print_total_ops(total_ops)
+
+    def run_scale(self, jobs):
+        '''
+        generate two queries of jobs jobs and time every stage on them
+        '''
+        self.args.jobs = jobs
+        generator = JobStatsGenerator(self.args)
+        _, reference = generator.query(0)
+        query_time, datas = generator.query(1)
+        parser = self.parser
+        parser.osts_mdts = Counter(param.split(':')[1].split('.')[0] for param, _ in datas)
+        parser.argparser.serverlist = {target.split(':')[0] for target, _ in datas}
+
+        references = self.parse(reference)
+        compacts = self.time(jobs, 'parse', self.parse, datas)
+        if 'parse_full' in self.selected:
+            self.time(jobs, 'parse_full', self.parse_full, datas)
+        partial, job_dicts = self.time(jobs, 'merge', self.merge, compacts)
+        rates, windows = self.time(jobs, 'rate', self.rate, compacts, references)
+        self.time(jobs, 'topk', parser.pick_top_jobs, job_dicts, self.args.count)
+        if 'topk_matrix' in self.selected:
+            self.time(jobs, 'topk_matrix', self.topk_matrix, partial)
+        self.time(jobs, 'print', self.print_stage, rates, windows, query_time)
+
+    @staticmethod
+    def commit():
+        '''
+        git commit of glljobstat.py, if it is in a git checkout
+        '''
+        try:
+            return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                                  cwd=Path(__file__).resolve().parent, capture_output=True,
+                                  text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return 'unknown'
+
+    def compare(self, path):
+        '''
+        print the ratio of the times to the last results saved in path
+        '''
+        try:
+            with open(path, encoding='utf-8') as resf:
+                last = json.loads(resf.readlines()[-1])
+        except (OSError, IndexError, ValueError) as err:
+            print(f'No results to compare in {path}: {err}')
+            return
+        old = {(result["jobs"], result["stage"]): result["seconds"] for
+               result in last["results"]}
+        print(f'compared to {last["commit"]} of {last["date"]}:')
+        print(f'{"jobs":>9} {"stage":<12} {"old s":>10} {"new s":>10} {"new/old":>8}')
+        for result in self.results:
+            key = (result["jobs"], result["stage"])
+            if key in old:
+                print(f'{key[0]:>9} {key[1]:<12} {old[key]:>10.4f} {result["seconds"]:>10.4f} '
+                      f'{result["seconds"] / max(old[key], 1e-9):>8.2f}')
+
+    def run(self):
+        '''
+        time all stages at every scale, save and compare the results
+        '''
+        print(f'{"jobs":>9} {"stage":<12} {"best s":>10}')
+        for jobs in (int(jobs) for jobs in self.args.jobs.split(',')):
+            self.run_scale(jobs)
+        if self.args.compare:
+            self.compare(self.args.compare)
+        if self.args.save:
+            run = {"date": time.strftime('%Y-%m-%dT%H:%M:%S'), "commit": self.commit(),
+                   "python": platform.python_version(), "targets": self.args.targets,
+                   "spread": self.args.spread, "lustre": self.args.lustre,
+                   "results": self.results}
+            with open(self.args.save, 'a', encoding='utf-8') as resf:
+                resf.write(json.dumps(run) + '\n')
+
+
+class ParserBench:
+    '''
+    Class to time the full job_stats parser against the fast path
+    '''
+    def __init__(self, args):
+        self.args = args
+        self.jobstats = JobStatsParser()
+
+    @staticmethod
+    def read_capture(path):
+        '''
+        read a capture file as raw bytes
+        '''
+        if path.endswith('.gz'):
+            with gzip.open(path, 'rb') as capf:
+                return capf.read()
+        if path.endswith('.xz'):
+            with lzma.open(path, 'rb') as capf:
+                return capf.read()
+        with open(path, 'rb') as capf:
+            return capf.read()
+
+    def best_of(self, func, data):
+        '''
+        run func on data, return its result and the best time of all rounds
+        '''
+        best = None
+        for _ in range(max(self.args.rounds, 1)):
+            start = time.perf_counter()
+            result = func(data)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return result, best
+
+    def full(self, data):
+        '''
+        what the parser processes did before: decode, parse everything, pack
+        '''
+        parsed = self.jobstats.parse_single_job_stats_beo(data.decode('UTF-8'))
+        return CompactJobStats.from_job_stats(parsed["job_stats"], self.jobstats.op_names)
+
+    def fast(self, data):
+        '''
+        samples-only parsing of the raw bytes
+        '''
+        return CompactJobStats.from_bytes(data, self.jobstats.op_names)
+
+    @staticmethod
+    def same(compact_a, compact_b):
+        '''
+        compare the content of two CompactJobStats
+        '''
+        return (compact_a.ops == compact_b.ops and compact_a.job_ids == compact_b.job_ids and
+                compact_a.times == compact_b.times and compact_a.samples == compact_b.samples)
+
+    def run(self):
+        '''
+        time both parsers on every capture
+        '''
+        print(f"{'capture':<32} {'MiB':>8} {'jobs':>8} {'full s':>8} {'fast s':>8} "
+              f"{'MiB/s':>8} {'speedup':>8}")
+        failed = False
+        for path in self.args.captures:
+            data = self.read_capture(path)
+            full, full_time = self.best_of(self.full, data)
+            fast, fast_time = self.best_of(self.fast, data)
+            mib = len(data) / 2**20
+            print(f"{path[-32:]:<32} {mib:>8.1f} {len(fast):>8} {full_time:>8.3f} "
+                  f"{fast_time:>8.3f} {mib / fast_time:>8.1f} {full_time / fast_time:>7.1f}x")
+            if not self.same(full, fast):
+                print(f"{path}: fast parser result differs from the full parser")
+                failed = True
+        return failed
+
+
+def main(argv=None):
+    '''
+    run the selected benchmark
+    '''
+    args = BenchArgParser().parse(argv)
+    if args.bench == 'parser':
+        failed = ParserBench(args).run()
+        sys.exit(1 if failed else 0)
+    if args.bench == 'gen':
+        JobStatsGenerator(args).write(args.output, args.ticks, args.interval, args.raw)
+    if args.bench == 'stages':
+        StageBench(args).run()
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print()
+        sys.exit()
@@ -0,0 +1,66 @@
+'''
+Tests for the batched query of all targets of a server, -b/--batch
+'''
+# pylint: disable=C0116
+import shlex
+import subprocess
+import sys
+import unittest
+from pathlib import Path
+
+REPO = Path(__file__).resolve().parents[1]
+FIXTURE = REPO / 'tests' / 'fixtures' / 'lustre' / 'proc' / 'fs' / 'lustre'
+sys.path.insert(0, str(REPO))
+
+import glljobstat  # pylint: disable=C0413
+
+PARAMS = ['obdfilter.fs-OST0000.job_stats', 'obdfilter.fs-OST0001.job_stats',
+          'mdt.fs-MDT0000.job_stats']
+
+
+class BatchTest(unittest.TestCase):
+    '''
+    batch_cmd run by a shell with a fake lctl and split_batch of its output
+    '''
+    def setUp(self):
+        self.parser = glljobstat.JobStatsParser()
+        self.outputs = {param: (FIXTURE / param.replace('.', '/')).read_bytes()
+                        for param in PARAMS}
+        # the last target has no job_stats, the first one no final newline
+        self.outputs[PARAMS[0]] = self.outputs[PARAMS[0]].rstrip(b'\n')
+        self.outputs[PARAMS[2]] = b''
+
+    def run_batch(self, params):
+        lctl = 'lctl() { case "$3" in ' + ' '.join(
+            f'{shlex.quote(param)}) printf %s {shlex.quote(self.outputs[param].decode())};;'
+            for param in params) + ' esac; }; '
+        return subprocess.run(['sh', '-c', lctl + self.parser.batch_cmd(params)],
+                              capture_output=True, check=True, timeout=60).stdout
+
+    def test_split(self):
+        output = self.run_batch(PARAMS)
+        self.assertEqual(self.parser.split_batch(output),
+                         [self.outputs[param] for param in PARAMS])
+
+    def test_split_single(self):
+        output = self.run_batch(PARAMS[1:2])
+        self.assertEqual(self.parser.split_batch(output), [self.outputs[PARAMS[1]]])
+        self.assertEqual(self.parser.split_batch(b''), [])
+
+    def test_stream(self):
+        output = self.run_batch(PARAMS)
+        expected = [self.parser.parse_single_job_stats_beo(self.outputs[param].decode())
+                    for param in PARAMS]
+        for size in [1, 7, len(output)]:
+            stream_parser = glljobstat.JobStatsStreamParser(
+                self.parser.parse_single_job_stats_beo, self.parser.batch_marker)
+            for start in range(0, len(output), size):
+                stream_parser.feed(output[start:start + size])
+            targets = stream_parser.close()
+            self.assertEqual([target['job_stats'] for target in targets],
+                             [stats.get('job_stats', []) for stats in expected])
+            self.assertEqual([len(target['job_stats']) for target in targets], [2, 2, 0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+'''
+Tests for the job_id filter entries of -f/--filter
+'''
+# pylint: disable=C0116
+import subprocess
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+REPO = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO))
+
+import glljobstat  # pylint: disable=C0413
+
+
+class JobFilterTest(unittest.TestCase):
+    '''
+    JobFilter matching plain and --groupby quoted job_ids
+    '''
+    def test_exact(self):
+        jobfilter = glljobstat.JobFilter(['=1202'])
+        self.assertTrue(jobfilter.match('1202'))
+        self.assertTrue(jobfilter.match('"1202"'))
+        self.assertFalse(jobfilter.match('12023'))
+        self.assertFalse(jobfilter.match('"12023"'))
+        self.assertFalse(jobfilter.match('"1202'))
+
+    def test_prefix(self):
+        jobfilter = glljobstat.JobFilter(['^120', '^dd.'])
+        for job_id in ['1202', '"1202"', '120', 'dd.1000', '"dd.1000"']:
+            self.assertTrue(jobfilter.match(job_id), job_id)
+        for job_id in ['1120', '"1120"', 'ddx1000', '12']:
+            self.assertFalse(jobfilter.match(job_id), job_id)
+
+    def test_substring(self):
+        jobfilter = glljobstat.JobFilter(['202', 'cp.'])
+        for job_id in ['1202', '"1202"', 'cp.1000@node1']:
+            self.assertTrue(jobfilter.match(job_id), job_id)
+        self.assertFalse(jobfilter.match('cpx1000'))
+
+    def test_regex(self):
+        jobfilter = glljobstat.JobFilter(['re:(?i)^RSYNC\\.', 're:@node0[12]$'])
+        for job_id in ['rsync.1000', 'Rsync.0', '1@1000@node01']:
+            self.assertTrue(jobfilter.match(job_id), job_id)
+        for job_id in ['xrsync.1000', '1@1000@node03']:
+            self.assertFalse(jobfilter.match(job_id), job_id)
+
+    def test_mixed(self):
+        jobfilter = glljobstat.JobFilter([' =1202', '^30 ', 'abc', 're:^x', ''])
+        self.assertEqual(len(jobfilter), 4)
+        for job_id in ['"1202"', '"3000"', 'zabcz', 'x1']:
+            self.assertTrue(jobfilter.match(job_id), job_id)
+        for job_id in ['"99"', '1203', 'y1']:
+            self.assertFalse(jobfilter.match(job_id), job_id)
+        # cached results give the same answer
+        self.assertTrue(jobfilter.match('"1202"'))
+        self.assertFalse(jobfilter.match('"99"'))
+
+    def test_empty_prefix(self):
+        self.assertTrue(glljobstat.JobFilter(['^']).match('anything'))
+
+    def test_groupby_run(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            result = subprocess.run([sys.executable, str(REPO / 'glljobstat.py'),
+                                     '-cfg', str(Path(tmpdir) / 'glljobstat.conf'),
+                                     '-lc', str(REPO / 'tests' / 'fixtures' / 'lustre'),
+                                     '--groupby', 'user', '-fm', '-f', '=1001,^1003', '-n', '1'],
+                                    capture_output=True, text=True, timeout=60, check=True)
+        jobs = [line.split(':')[0] for line in result.stdout.splitlines()
+                if line.startswith('- "')]
+        self.assertEqual(jobs, ['- "1001"', '- "1003"'])
+
+
+if __name__ == '__main__':
+    unittest.main()
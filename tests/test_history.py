@@ -0,0 +1,92 @@
+'''
+Tests for the -hf/--historyfile ring buffer
+'''
+# pylint: disable=C0116
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import glljobstat  # pylint: disable=C0413
+
+OPS = ['open', 'close', 'read', 'write']
+
+
+@unittest.skipIf(glljobstat.np is None, 'needs numpy')
+class RateHistoryTest(unittest.TestCase):
+    '''
+    RateHistory writing, wrapping around and reopening
+    '''
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory() # pylint: disable=consider-using-with
+        self.path = str(Path(self.tmpdir.name) / 'hist.rh')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    @staticmethod
+    def append(history, timestamp, job_ids):
+        history.append(timestamp, job_ids, [10] * len(job_ids),
+                       [[timestamp, 0, i, 0] for i in range(len(job_ids))])
+
+    @staticmethod
+    def logged(history):
+        records = history.scan()
+        return list(zip(records['timestamp'].tolist(), history.job_ids(records)))
+
+    def test_wraparound(self):
+        history = glljobstat.RateHistory(self.path, 5, OPS)
+        for timestamp in range(1, 5):
+            self.append(history, timestamp, [f'job{timestamp}', 'common'])
+        self.assertEqual(history.head, 8)
+        self.assertEqual(self.logged(history), [(2, 'common'), (3, 'job3'), (3, 'common'),
+                                                (4, 'job4'), (4, 'common')])
+        self.assertEqual(len(history.scan(3, 3)), 2)
+        self.assertEqual(history.scan(3, 3)['rates'][:, 0].tolist(), [3, 3])
+        history.close()
+
+    def test_reopen(self):
+        history = glljobstat.RateHistory(self.path, 6, OPS)
+        self.append(history, 1, ['a', 'b'])
+        history.close()
+
+        history = glljobstat.RateHistory(self.path, 6, OPS)
+        self.append(history, 2, ['b', 'c'])
+        history.close()
+
+        history = glljobstat.RateHistory(self.path)
+        self.assertEqual(self.logged(history), [(1, 'a'), (1, 'b'), (2, 'b'), (2, 'c')])
+        self.assertEqual(sorted(history.slots.values()), [0, 1, 2])
+        history.close()
+
+    def test_reopen_after_wraparound(self):
+        history = glljobstat.RateHistory(self.path, 3, OPS)
+        for timestamp in range(1, 4):
+            self.append(history, timestamp, [f'job{timestamp}'])
+        history.close()
+
+        # the table is full, new jobs take over the slot of the oldest one
+        history = glljobstat.RateHistory(self.path, 3, OPS)
+        self.append(history, 4, ['job4'])
+        self.append(history, 5, ['job2'])
+        self.assertEqual(self.logged(history), [(3, 'job3'), (4, 'job4'), (5, 'job2')])
+        history.close()
+
+    def test_long_job_ids(self):
+        prefix = 'x' * glljobstat.RateHistory.name_length
+        history = glljobstat.RateHistory(self.path, 10, OPS)
+        self.append(history, 1, [prefix, prefix + 'a', prefix + 'b', 'short'])
+        self.assertEqual(history.skipped, 2)
+        history.close()
+
+        history = glljobstat.RateHistory(self.path, 10, OPS)
+        self.append(history, 2, [prefix, 'new'])
+        self.assertEqual(self.logged(history), [(1, prefix), (1, 'short'), (2, prefix), (2, 'new')])
+        self.assertEqual(len(set(history.slots.values())), 3)
+        history.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+'''
+Tests for the -lc/--local backend against the procfs/sysfs copy in
+fixtures/lustre
+'''
+# pylint: disable=C0116
+import subprocess
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+REPO = Path(__file__).resolve().parents[1]
+FIXTURE = REPO / 'tests' / 'fixtures' / 'lustre'
+sys.path.insert(0, str(REPO))
+
+import glljobstat  # pylint: disable=C0413
+
+
+class LocalStatsTest(unittest.TestCase):
+    '''
+    LocalStats reading the fixture tree
+    '''
+    def test_list_param(self):
+        local = glljobstat.LocalStats(FIXTURE)
+        params = local.list_param('*.*.job_stats')
+        self.assertEqual(params, ['mdt.fs-MDT0000.job_stats',
+                                  'obdfilter.fs-OST0000.job_stats',
+                                  'obdfilter.fs-OST0001.job_stats'])
+        self.assertEqual(local.list_param('*.*.job_stats'), params)
+        self.assertEqual(local.list_param('obdfilter.*.job_stats'), params[1:])
+
+    def test_get_param(self):
+        local = glljobstat.LocalStats(FIXTURE)
+        self.assertEqual(local.get_param('jobid_name').strip(), b'%j@%u@%H')
+        self.assertTrue(local.get_param('mdt.fs-MDT0000.job_stats').startswith(b'job_stats:'))
+        with self.assertRaises(FileNotFoundError):
+            local.get_param('obdfilter.fs-OST0002.job_stats')
+
+    def test_run(self):
+        # parsed in the main process and in two parser processes
+        for options in [[], ['-ipb', '0', '-npp', '2']]:
+            with self.subTest(options=options), tempfile.TemporaryDirectory() as tmpdir:
+                result = subprocess.run([sys.executable, str(REPO / 'glljobstat.py'),
+                                         '-cfg', str(Path(tmpdir) / 'glljobstat.conf'),
+                                         '-lc', str(FIXTURE), '-n', '1', '-c', '10'] + options,
+                                        capture_output=True, text=True, timeout=60, check=True)
+                lines = result.stdout.splitlines()
+                for line in ['servers_queried: 1', 'osts_queried: 2', 'mdts_queried: 1',
+                             'total_jobs: 3',
+                             '- 1@1001@node01:   {ops: 43, op: 3, cl: 3, rd: 10, wr: 27}',
+                             '- 2@1002@node02:   {ops: 13, ga: 8, rd: 5}',
+                             '- 3@1003@node03:   {ops: 4, pu: 4}']:
+                    self.assertIn(line, lines)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+'''
+Tests for the per target rates of -r/--rate and -d/--difference
+'''
+# pylint: disable=C0116
+import sys
+import unittest
+from array import array
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import glljobstat  # pylint: disable=C0413
+
+
+def counters(ops, jobs):
+    '''
+    CompactJobStats of jobs given as (job_id, snapshot, start, samples)
+    '''
+    times, samples = array('q'), array('q')
+    for _, snapshot, start, values in jobs:
+        times.extend([snapshot, start, snapshot - start])
+        samples.extend(values)
+    return glljobstat.CompactJobStats(ops, [job[0] for job in jobs], times, samples)
+
+
+def rates_of(rates):
+    '''
+    job_id -> (window, {op: rate}) of CompactJobRates
+    '''
+    width = len(rates.ops)
+    return {job_id: (rates.windows[i],
+                     {op: rates.samples[width * i + col] for col, op in enumerate(rates.ops)
+                      if rates.present[width * i + col]})
+            for i, job_id in enumerate(rates.job_ids)}
+
+
+class FromCountersTest(unittest.TestCase):
+    '''
+    CompactJobRates.from_counters with increasing, reset and new counters
+    '''
+    ops = ['open', 'close', 'read']
+
+    def test_rate(self):
+        ref = counters(self.ops, [('a', 100, 10, [10, 20, 0])])
+        new = counters(self.ops, [('a', 110, 10, [30, 20, 50])])
+        rates = rates_of(glljobstat.CompactJobRates.from_counters(new, ref, True))
+        self.assertEqual(rates, {'a': (10, {'open': 2.0, 'close': 0.0, 'read': 5.0})})
+
+    def test_difference(self):
+        ref = counters(self.ops, [('a', 100, 10, [10, 20, 0])])
+        new = counters(self.ops, [('a', 110, 10, [30, 20, 50])])
+        rates = rates_of(glljobstat.CompactJobRates.from_counters(new, ref, False))
+        self.assertEqual(rates, {'a': (10, {'open': 20, 'close': 0, 'read': 50})})
+
+    def test_counter_going_backwards(self):
+        ref = counters(self.ops, [('a', 100, 10, [50, 20, 0])])
+        new = counters(self.ops, [('a', 110, 10, [30, 40, 0])])
+        rates = rates_of(glljobstat.CompactJobRates.from_counters(new, ref, False))
+        self.assertEqual(rates, {'a': (10, {'open': 30, 'close': 20})})
+
+    def test_start_time_changed(self):
+        # the job was restarted, all of its counters count from zero again
+        ref = counters(self.ops, [('a', 100, 10, [10, 20, 30])])
+        new = counters(self.ops, [('a', 110, 105, [40, 25, 30])])
+        rates = rates_of(glljobstat.CompactJobRates.from_counters(new, ref, False))
+        self.assertEqual(rates, {'a': (10, {'open': 40, 'close': 25, 'read': 30})})
+
+    def test_new_job(self):
+        ref = counters(self.ops, [('a', 100, 10, [10, 0, 0])])
+        new = counters(self.ops, [('a', 110, 10, [10, 0, 0]),
+                                  ('started', 110, 104, [6, 0, 0]),
+                                  ('before', 110, 90, [6, 0, 0])])
+        rates = rates_of(glljobstat.CompactJobRates.from_counters(new, ref, True))
+        # started since the previous query: from zero over the whole window
+        self.assertEqual(rates['started'], (10, {'open': 0.6}))
+        # started before it but missing from it: no rate
+        self.assertEqual(rates['before'], (0, {}))
+        self.assertEqual(rates['a'], (10, {'open': 0.0}))
+
+    def test_new_op(self):
+        ref = counters(['open'], [('a', 100, 10, [10])])
+        new = counters(['read', 'open'], [('a', 110, 10, [30, 15])])
+        rates = rates_of(glljobstat.CompactJobRates.from_counters(new, ref, False))
+        self.assertEqual(rates, {'a': (10, {'read': 30, 'open': 5})})
+
+    def test_no_window(self):
+        ref = counters(self.ops, [('a', 100, 10, [10, 0, 0]), ('b', 100, 10, [1, 0, 0])])
+        new = counters(self.ops, [('a', 100, 10, [20, 0, 0]), ('b', -1, 10, [2, 0, 0])])
+        rates = rates_of(glljobstat.CompactJobRates.from_counters(new, ref, True))
+        self.assertEqual(rates, {'a': (0, {}), 'b': (0, {})})
+
+    def test_empty_reference(self):
+        ref = counters(self.ops, [])
+        new = counters(self.ops, [('a', 110, 10, [10, 0, 0])])
+        rates = rates_of(glljobstat.CompactJobRates.from_counters(new, ref, True))
+        self.assertEqual(rates, {'a': (0, {})})
+
+
+if __name__ == '__main__':
+    unittest.main()
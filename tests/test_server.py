@@ -0,0 +1,48 @@
+'''
+Tests for the Prometheus text of -srv/--serve and -mt/--metrics
+'''
+# pylint: disable=C0116
+import sys
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import glljobstat  # pylint: disable=C0413
+
+
+class PrometheusTest(unittest.TestCase):
+    '''
+    label escaping of the served and written metrics
+    '''
+    def test_label(self):
+        label = glljobstat.TickMetrics.label
+        self.assertEqual(label('op', 'open'), 'op="open"')
+        self.assertEqual(label('job_id', 'a"b'), 'job_id="a\\"b"')
+        self.assertEqual(label('job_id', 'a\\b'), 'job_id="a\\\\b"')
+        self.assertEqual(label('job_id', 'a\nb'), 'job_id="a\\nb"')
+        self.assertEqual(label('job_id', 'jöb.1000'), 'job_id="jöb.1000"')
+
+    def test_server_metrics(self):
+        snapshot = {'query_time': 1700000000, 'total_jobs': 2, 'missing_hosts': [],
+                    'totals': {'ops': 30, 'open': 30}}
+        top_jobs = [{'job_id': 'cp"x\\y', 'ops': 20, 'open': 20},
+                    {'job_id': 'dd.ü', 'ops': 10, 'open': 10}]
+        lines = glljobstat.JobStatsServer.prometheus(snapshot, top_jobs).splitlines()
+        self.assertIn('glljobstat_total_rate{op="open"} 30', lines)
+        self.assertIn('glljobstat_job_rate{job_id="cp\\"x\\\\y",op="ops"} 20', lines)
+        self.assertIn('glljobstat_job_rate{job_id="dd.ü",op="open"} 10', lines)
+        self.assertFalse(any('\\u' in line for line in lines))
+
+    def test_tick_metrics(self):
+        metrics = glljobstat.TickMetrics(fmt='prom')
+        metrics.start(1700000000)
+        metrics.set(tick_seconds=1.5)
+        metrics.target('srv"1:obdfilter.fs-OST0000.job_stats', jobs=3)
+        lines = metrics.prometheus().splitlines()
+        self.assertIn('glljobstat_target_jobs{target="srv\\"1:obdfilter.fs-OST0000.job_stats"} 3',
+                      lines)
+
+
+if __name__ == '__main__':
+    unittest.main()